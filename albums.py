@@ -0,0 +1,52 @@
+import asyncio
+
+ALBUM_DEBOUNCE = 1.0  # секунд тишины после последнего фото, чтобы считать альбом полным
+ALBUM_MAX_SIZE = 10  # больше Telegram в один альбом не кладет
+
+
+class AlbumCollector:
+    """Собирает сообщения одного альбома (media_group_id) в пачку.
+
+    Telegram присылает каждое фото альбома отдельным апдейтом. Коллектор
+    копит их, пока не пройдет ALBUM_DEBOUNCE секунд без новых фото (или пока
+    не наберется ALBUM_MAX_SIZE), и вызывает callback(messages, *context) один
+    раз на весь альбом. Сообщения передаются в порядке message_id.
+    """
+
+    def __init__(self, callback, delay=ALBUM_DEBOUNCE, max_size=ALBUM_MAX_SIZE):
+        self.callback = callback
+        self.delay = delay
+        self.max_size = max_size
+        self._albums = {}  # ключ -> [сообщения, контекст, таймер]
+        self._tasks = set()
+
+    def add(self, key, message, *context):
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = [[], context, None]
+        album[0].append(message)
+        if album[2] is not None:
+            album[2].cancel()
+        if len(album[0]) >= self.max_size:
+            self._flush(key)
+        else:
+            album[2] = asyncio.get_running_loop().call_later(self.delay, self._flush, key)
+
+    def _flush(self, key):
+        album = self._albums.pop(key, None)
+        if album is None:
+            return
+        messages, context, timer = album
+        if timer is not None:
+            timer.cancel()
+        messages.sort(key=lambda m: m.message_id)
+        task = asyncio.create_task(self.callback(messages, *context))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        """Обрабатывает недособранные альбомы сразу и ждет завершения (при остановке бота)."""
+        for key in list(self._albums):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
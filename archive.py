@@ -0,0 +1,47 @@
+"""Перенос закрытых месяцев в архивные файлы и сжатие основной БД.
+
+    python archive.py                   # все месяцы старше ARCHIVE_KEEP_MONTHS
+    python archive.py --before 2025-01  # все месяцы до января 2025
+
+Отчеты, машины, их позиции и фото месяца переезжают в archive/carwrap_ГГГГ.db.
+Отчеты, выгрузки и сводки за архивные месяцы работают как раньше: запросы
+подключают нужные файлы через ATTACH. Отпечатки архивных машин остаются в
+основной БД, поэтому повторно присланный отчет за архивный месяц не
+задваивается. Пересчет по прайсу работает только с основной БД.
+"""
+import argparse
+from datetime import date
+
+from db import archive_period, compact_db, get_archivable_periods
+
+ARCHIVE_KEEP_MONTHS = 3  # столько последних месяцев, включая текущий, остаются в основной БД
+
+
+def default_cutoff(keep_months=ARCHIVE_KEEP_MONTHS, today=None):
+    """Первый месяц ('ГГГГ-ММ'), который остается в основной БД."""
+    today = today or date.today()
+    months = today.year * 12 + today.month - keep_months
+    return f"{months // 12:04d}-{months % 12 + 1:02d}"
+
+
+def archive(before=None):
+    """Архивирует месяцы до before и сжимает БД; возвращает [(месяц, отчетов, машин, фото)]."""
+    results = [(period, *archive_period(period)) for period in get_archivable_periods(before or default_cutoff())]
+    if results:
+        compact_db()
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Перенос закрытых месяцев в архив")
+    arg_parser.add_argument("--before", help="ГГГГ-ММ: архивировать месяцы раньше этого")
+    arg_parser.add_argument("--keep-months", type=int, default=ARCHIVE_KEEP_MONTHS,
+                            help="сколько последних месяцев оставить (если не задан --before)")
+    args = arg_parser.parse_args()
+
+    from db import init_db
+    init_db()
+    results = archive(args.before or default_cutoff(args.keep_months))
+    for period, reports, cars, photos in results:
+        print(f"{period}: отчетов {reports}, машин {cars}, фото {photos}")
+    print(f"✅ Архивировано месяцев: {len(results)}" if results else "Архивировать нечего")
@@ -0,0 +1,116 @@
+"""Локальная замена Bot API и файлового сервера Telegram на aiohttp.
+
+Отвечает на методы, которые вызывает бот, считает запросы и отданные
+байты. Бот подключается к ней через TelegramAPIServer.from_base(url).
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+PHOTO_SIZE = 200 * 1024
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0, photo_size=PHOTO_SIZE):
+        self.latency = latency
+        self.photo_size = photo_size
+        self.calls = Counter()
+        self.uploaded_bytes = 0
+        self.downloaded_bytes = 0
+        self._message_ids = itertools.count(1)
+        self.app = web.Application(client_max_size=100 * 1024 * 1024)
+        self.app.router.add_post("/bot{token}/{method}", self.handle_method)
+        self.app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        self.runner = None
+        self.url = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def reset(self):
+        self.calls.clear()
+        self.uploaded_bytes = 0
+        self.downloaded_bytes = 0
+
+    async def _params(self, request):
+        if request.content_type == "multipart/form-data":
+            params = {}
+            reader = await request.multipart()
+            async for part in reader:
+                data = await part.read()
+                if part.filename:
+                    self.uploaded_bytes += len(data)
+                    params[part.name] = {"filename": part.filename, "size": len(data)}
+                else:
+                    params[part.name] = data.decode("utf-8")
+            return params
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    def _message(self, chat_id, **fields):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+        }
+        message.update(fields)
+        return message
+
+    async def handle_method(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = await self._params(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = params.get("chat_id", 0)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "sendDocument":
+            document = params.get("document", {})
+            result = self._message(chat_id, document={
+                "file_id": "doc", "file_unique_id": "doc",
+                "file_name": document.get("filename") if isinstance(document, dict) else None,
+            })
+        elif method == "sendPhoto":
+            result = self._message(chat_id, photo=[{"file_id": "p", "file_unique_id": "p", "width": 1, "height": 1}])
+        elif method == "sendMediaGroup":
+            media = params.get("media", "[]")
+            media = json.loads(media) if isinstance(media, str) else media
+            result = [self._message(chat_id, photo=[{"file_id": "p", "file_unique_id": "p", "width": 1, "height": 1}])
+                      for _ in media]
+        elif method == "getFile":
+            file_id = params.get("file_id", "")
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": self.photo_size,
+                      "file_path": f"photos/{file_id}.jpg"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_file(self, request):
+        self.calls["file"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        # детерминированные "фото" нужного размера
+        seed = hashlib.sha1(request.match_info["path"].encode("utf-8")).digest()
+        body = (seed * (self.photo_size // len(seed) + 1))[:self.photo_size]
+        self.downloaded_bytes += len(body)
+        return web.Response(body=body, content_type="image/jpeg")
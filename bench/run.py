@@ -0,0 +1,427 @@
+"""Бенчмарки разбора отчетов, работы с БД и выгрузок.
+
+    python -m bench.run                          # все бенчмарки
+    python -m bench.run --only micro --quick     # только микробенчмарки, меньше данных
+    python -m bench.run --output bench.json      # сохранить результаты
+    python -m bench.run --baseline bench.json    # сравнить с прошлым запуском
+    python -m bench.run --only startup           # время импорта бота и проверка ленивых модулей
+
+Запускать из корня репозитория. Бенчмарки работают на временной БД и
+временном кэше фото; сквозные прогоны ходят не в Telegram, а в локальную
+замену Bot API (bench/fake_telegram.py). При регрессии медианы больше
+порога (--threshold), превышении IMPORT_BUDGET_SHARE или загрузке модулей из
+LAZY_MODULES при импорте бота процесс завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули выгрузок грузятся при первой выгрузке, а не при старте бота
+LAZY_MODULES = ("openpyxl", "excel_export", "photo_export")
+# Доля собственных модулей бота во времени импорта bot в том же процессе:
+# база (aiogram, aiohttp) меряется тем же прогоном, поэтому порог не зависит
+# от скорости машины. Сейчас доля меньше 1%, порог взят с большим запасом.
+IMPORT_BUDGET_SHARE = 0.1
+STARTUP_SCRIPT = f"""
+import json, sys, types
+config = types.ModuleType("config")
+config.BOT_TOKEN = "42:BENCH"
+config.ADMIN_PASSWORD = "bench"
+sys.modules["config"] = config
+import bot
+print(json.dumps([name for name in {LAZY_MODULES!r} if name in sys.modules]))
+"""
+
+
+class Results:
+    def __init__(self):
+        self.items = {}
+
+    def add(self, name, samples, ops=1, **extra):
+        """samples — длительности прогонов в секундах, ops — операций в одном прогоне."""
+        per_op = [s / ops * 1000 for s in samples]
+        item = {
+            "median_ms": statistics.median(per_op),
+            "min_ms": min(per_op),
+            "mean_ms": statistics.fmean(per_op),
+            "runs": len(samples),
+            "ops": ops,
+        }
+        item.update(extra)
+        self.items[name] = item
+        print(f"{name:38s} {item['median_ms']:10.3f} мс/оп  (мин {item['min_ms']:.3f}, прогонов {len(samples)})")
+
+
+def measure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def ameasure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def setup_environment(workdir):
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import db
+    import photo_cache
+    db.DB_NAME = os.path.join(workdir, "bench.db")
+    db.init_db()
+    photo_cache._cache = photo_cache.PhotoCache(os.path.join(workdir, "photo_cache"))
+
+
+def populate(gen, count, user_ids):
+    """Заполняет БД отчетами за текущий год; возвращает число машин."""
+    import db
+    from catalog import get_catalog
+    from parser import parse_report_text
+    catalog = get_catalog()
+    total = 0
+    for i, text in enumerate(gen.reports(count)):
+        cars, report_date = parse_report_text(text, catalog)
+        db.ingest_report(user_ids[i % len(user_ids)], report_date, cars,
+                         [f"photo_{i}_{n}" for n in range(2)], catalog.version)
+        total += len(cars)
+    return total
+
+
+def run_micro(results, gen, sizes):
+    import db
+    from catalog import get_catalog
+    from matcher import ServiceMatcher
+    from parser import parse_report_text, process_entry
+
+    catalog = get_catalog()
+    texts = [gen.report(days=2) for _ in range(sizes["texts"])]
+    results.add("parse_report_text", measure(lambda: [parse_report_text(t, catalog) for t in texts],
+                                             sizes["repeat"]), ops=len(texts))
+
+    lines = [gen.car_line().split(" ", 1) for _ in range(sizes["texts"])]
+    elements, labor, price = catalog.as_tuple()
+    matcher = catalog.matcher
+
+    def entries(cold):
+        if cold:
+            matcher._cache.clear()
+        for plate, description in lines:
+            process_entry(plate, description, elements, labor, price, "2025-07-01", matcher=matcher)
+
+    results.add("process_entry.cold", measure(lambda: entries(True), sizes["repeat"]), ops=len(lines))
+    results.add("process_entry.warm", measure(lambda: entries(False), sizes["repeat"]), ops=len(lines))
+    results.add("matcher.compile", measure(lambda: ServiceMatcher(elements, labor), sizes["repeat"]))
+
+    uid = db.resolve_user(999, "bench")[0]
+    cars = [{"plate": f"А{n:03d}ВС", "description": "капот", "area": 1.7, "cost": 612, "labor_cost": 1500}
+            for n in range(20)]
+
+    def legacy_ingest():
+        report_id = db.add_report(uid, "2000-01-01")
+        for car in cars:
+            db.add_car(report_id, car["plate"], car["description"], car["area"], car["cost"], car["labor_cost"])
+
+    results.add("db.ingest_legacy_20_cars", measure(legacy_ingest, sizes["repeat"]))
+    runs = itertools.count()
+
+    def ingest():
+        # свежие номера на каждый прогон, иначе машины отсекаются как повторы
+        run = next(runs)
+        db.ingest_report(uid, "2000-01-01", [dict(car, plate=f"{car['plate']}{run}") for car in cars], ["p1", "p2"])
+
+    results.add("db.ingest_report_20_cars", measure(ingest, sizes["repeat"]))
+    results.add("db.ingest_report_20_duplicates",
+                measure(lambda: db.ingest_report(uid, "2000-01-01", cars, ["p1", "p2"]), sizes["repeat"]))
+
+    year = date.today().year
+    results.add("db.report_summary.month",
+                measure(lambda: db.get_report_summary(f"{year}-07-01", f"{year}-07-31"), sizes["repeat"]))
+    results.add("db.report_summary.year",
+                measure(lambda: db.get_report_summary(f"{year}-01-01", f"{year}-12-31"), sizes["repeat"]))
+    from period_report import build_report
+    results.add("db.period_report.month",
+                measure(lambda: build_report(f"{year}-07-01", f"{year}-07-31"), sizes["repeat"]))
+    results.add("db.period_report.year",
+                measure(lambda: build_report(f"{year}-01-01", f"{year}-12-31"), sizes["repeat_slow"]))
+
+
+def _import_profile():
+    """Импорт bot в чистом процессе: (всего мс, мс в модулях бота, загруженные модули из LAZY_MODULES)."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    own = {name[:-3] for name in os.listdir(ROOT) if name.endswith(".py")}
+    total_us = own_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if name == "bot":
+            total_us = int(cumulative_us)
+        if name in own:
+            own_us += int(self_us)
+    return total_us / 1000, own_us / 1000, json.loads(proc.stdout)
+
+
+def run_startup(results, sizes):
+    """Время холодного старта; возвращает список нарушений бюджета."""
+    import db
+    profiles = [_import_profile() for _ in range(sizes["repeat_slow"] + 2)]
+    results.add("startup.import_bot", [total / 1000 for total, _, _ in profiles])
+    results.add("startup.import_own_modules", [own / 1000 for _, own, _ in profiles])
+    # Схема уже последней версии: init_db только читает user_version
+    results.add("startup.migrate_noop", measure(db.init_db, sizes["repeat"]))
+
+    problems = []
+    loaded = profiles[0][2]
+    if loaded:
+        problems.append(f"при импорте бота загружены модули выгрузок: {', '.join(loaded)}")
+    share = statistics.median(own / total for total, own, _ in profiles)
+    if share > IMPORT_BUDGET_SHARE:
+        problems.append(f"импорт модулей бота занимает {share:.1%} импорта bot, бюджет {IMPORT_BUDGET_SHARE:.1%}")
+    return problems
+
+
+def run_exports(results, workdir, sizes):
+    from excel_export import create_excel_report
+    year = date.today().year
+    path = os.path.join(workdir, "bench.xlsx")
+    samples = measure(lambda: create_excel_report(f"{year}-01-01", f"{year}-12-31", path), sizes["repeat_slow"])
+    results.add("export.excel.year", samples, bytes=os.path.getsize(path))
+
+
+def _config_stub():
+    # handlers и bot читают config.py, которого нет в репозитории
+    if "config" not in sys.modules:
+        config = types.ModuleType("config")
+        config.BOT_TOKEN = "42:BENCH"
+        config.ADMIN_PASSWORD = "bench"
+        sys.modules["config"] = config
+
+
+async def run_e2e(results, gen, workdir, sizes, latency):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import Update
+
+    _config_stub()
+    import db
+    import photo_cache
+    from bench.fake_telegram import FakeTelegram
+    from bot import create_dispatcher
+    from export_jobs import export_queue
+
+    fake = FakeTelegram(latency=latency)
+    url = await fake.start()
+    bot = Bot("42:BENCH", session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    dp = create_dispatcher()
+    export_queue.start(bot)
+    update_ids = itertools.count(1)
+    message_ids = itertools.count(1)
+
+    async def send(tg_id, text=None, photo=None, caption=None, media_group_id=None):
+        message = {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": tg_id, "type": "private"},
+            "from": {"id": tg_id, "is_bot": False, "first_name": f"Сотрудник {tg_id}"},
+        }
+        if text is not None:
+            message["text"] = text
+        if photo is not None:
+            message["photo"] = [{"file_id": photo, "file_unique_id": photo, "width": 1280, "height": 960}]
+            if caption:
+                message["caption"] = caption
+            if media_group_id:
+                message["media_group_id"] = media_group_id
+        update = Update.model_validate({"update_id": next(update_ids), "message": message}, context={"bot": bot})
+        await dp.feed_update(bot, update)
+
+    try:
+        texts = [gen.report() for _ in range(sizes["updates"])]
+        users = itertools.cycle(range(100, 110))
+        fake.reset()
+        samples = await ameasure(lambda: asyncio.gather(*(send(next(users), t) for t in texts)), 1)
+        results.add("e2e.handle_text_report", samples, ops=len(texts), telegram_calls=dict(fake.calls))
+
+        from handlers import album_collector
+
+        async def albums():
+            for n in range(sizes["albums"]):
+                tg_id = next(users)
+                for i in range(10):
+                    await send(tg_id, photo=f"album_{n}_{i}", caption=gen.report() if i == 0 else None,
+                               media_group_id=f"album_{n}")
+            await album_collector.drain()
+
+        fake.reset()
+        samples = await ameasure(albums, 1)
+        results.add("e2e.album_10_photos", samples, ops=sizes["albums"], telegram_calls=dict(fake.calls))
+
+        admin = 1
+        await send(admin, "/start")
+        db.set_admin(admin)
+        import user_context
+        user_context.user_cache.invalidate(admin)
+        year = date.today().year
+
+        def drop_artifacts():
+            # холодный прогон: готовые выгрузки из кэша не отдаются
+            with db.get_connection() as conn:
+                conn.execute("DELETE FROM export_artifacts")
+
+        async def report_flow():
+            await send(admin, "📊 Отчет")
+            await send(admin, f"{year}-07")
+            await export_queue.join()
+
+        async def report_flow_cold():
+            drop_artifacts()
+            await report_flow()
+
+        fake.reset()
+        samples = await ameasure(report_flow_cold, sizes["repeat_slow"])
+        results.add("e2e.report_flow.month", samples, telegram_calls=dict(fake.calls),
+                    uploaded_bytes=fake.uploaded_bytes // max(len(samples), 1))
+        fake.reset()
+        samples = await ameasure(report_flow, sizes["repeat_slow"])
+        results.add("e2e.report_flow.cached", samples, telegram_calls=dict(fake.calls),
+                    uploaded_bytes=fake.uploaded_bytes // max(len(samples), 1))
+
+        async def photo_flow():
+            await send(admin, "📸 Фото")
+            await send(admin, f"{year}-07")
+            await export_queue.join()
+
+        photo_cache._cache = photo_cache.PhotoCache(os.path.join(workdir, "photo_cache_e2e"))
+        drop_artifacts()
+        fake.reset()
+        samples = await ameasure(photo_flow, 1)
+        results.add("e2e.photo_export.cold", samples, downloaded_bytes=fake.downloaded_bytes,
+                    uploaded_bytes=fake.uploaded_bytes, telegram_calls=dict(fake.calls))
+        drop_artifacts()
+        fake.reset()
+        samples = await ameasure(photo_flow, 1)
+        results.add("e2e.photo_export.warm", samples, downloaded_bytes=fake.downloaded_bytes,
+                    uploaded_bytes=fake.uploaded_bytes, telegram_calls=dict(fake.calls))
+        fake.reset()
+        samples = await ameasure(photo_flow, 1)
+        results.add("e2e.photo_export.cached", samples, downloaded_bytes=fake.downloaded_bytes,
+                    uploaded_bytes=fake.uploaded_bytes, telegram_calls=dict(fake.calls))
+    finally:
+        await export_queue.stop()
+        await bot.session.close()
+        await fake.stop()
+        from db_async import shutdown
+        shutdown()
+
+
+def compare(results, baseline, threshold):
+    """Список (имя, было, стало) для бенчмарков, где медиана выросла больше порога."""
+    regressions = []
+    for name, item in results.items():
+        old = baseline.get(name)
+        if old and item["median_ms"] > old["median_ms"] * (1 + threshold):
+            regressions.append((name, old["median_ms"], item["median_ms"]))
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Бенчмарки car-wrapping-bot")
+    arg_parser.add_argument("--only", choices=["micro", "export", "e2e", "startup"], action="append",
+                            help="какие группы запускать (по умолчанию все)")
+    arg_parser.add_argument("--quick", action="store_true", help="меньше данных и повторов")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    arg_parser.add_argument("--reports", type=int, default=None, help="отчетов в тестовой БД")
+    arg_parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа fake API, сек")
+    arg_parser.add_argument("--output", help="куда сохранить результаты в JSON")
+    arg_parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    arg_parser.add_argument("--threshold", type=float, default=0.2, help="допустимый рост медианы (0.2 = 20%%)")
+    args = arg_parser.parse_args()
+
+    groups = set(args.only or ["micro", "export", "e2e", "startup"])
+    sizes = {"texts": 200, "repeat": 20, "repeat_slow": 3, "updates": 200, "albums": 20, "reports": 2000}
+    if args.quick:
+        sizes = {"texts": 50, "repeat": 5, "repeat_slow": 1, "updates": 50, "albums": 5, "reports": 300}
+    if args.reports:
+        sizes["reports"] = args.reports
+
+    results = Results()
+    problems = []
+    with tempfile.TemporaryDirectory() as workdir:
+        setup_environment(workdir)
+        from bench.synthetic import ReportGenerator
+        from catalog import get_catalog
+        gen = ReportGenerator(get_catalog().elements, seed=args.seed)
+
+        import db
+        user_ids = [db.resolve_user(tg_id, f"Сотрудник {tg_id}")[0] for tg_id in range(100, 110)]
+        start = time.perf_counter()
+        cars = populate(gen, sizes["reports"], user_ids)
+        print(f"Тестовая БД: {sizes['reports']} отчетов, {cars} машин ({time.perf_counter() - start:.1f} с)")
+
+        if "micro" in groups:
+            run_micro(results, gen, sizes)
+        if "export" in groups:
+            run_exports(results, workdir, sizes)
+        if "startup" in groups:
+            problems = run_startup(results, sizes)
+        if "e2e" in groups:
+            # в конце: остановка бота закрывает соединения с БД
+            asyncio.run(run_e2e(results, gen, workdir, sizes, args.latency))
+        os.chdir(ROOT)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "seed": args.seed,
+        },
+        "results": results.items,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for problem in problems:
+        print(f"❌ Старт: {problem}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results.items, baseline, args.threshold)
+        for name, old, new in regressions:
+            print(f"❌ Регрессия {name}: {old:.3f} → {new:.3f} мс/оп")
+        if regressions:
+            sys.exit(1)
+        print("✅ Регрессий нет")
+
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Генератор правдоподобных отчетов сотрудников для бенчмарков."""
+import random
+from datetime import date, timedelta
+
+PLATE_LETTERS = "АВЕКМНОРСТУХ"
+
+# Фрагменты, которых нет в прайсе, — как в реальном unrecognized_services.txt
+UNKNOWN_FRAGMENTS = ["кай бампер", "мелкий ремонт", "полировка фар", "таксопарк"]
+
+
+def random_plate(rng):
+    return (rng.choice(PLATE_LETTERS) + f"{rng.randint(1, 999):03d}"
+            + rng.choice(PLATE_LETTERS) + rng.choice(PLATE_LETTERS))
+
+
+def add_typo(rng, fragment):
+    """Одна замена, пропуск или перестановка буквы в случайном слове."""
+    words = fragment.split()
+    idx = rng.randrange(len(words))
+    word = words[idx]
+    if len(word) < 4:
+        return fragment
+    pos = rng.randrange(1, len(word) - 1)
+    kind = rng.randrange(3)
+    if kind == 0:
+        word = word[:pos] + rng.choice("абвгдеклмнопрст") + word[pos + 1:]
+    elif kind == 1:
+        word = word[:pos] + word[pos + 1:]
+    else:
+        word = word[:pos - 1] + word[pos] + word[pos - 1] + word[pos + 1:]
+    words[idx] = word
+    return " ".join(words)
+
+
+class ReportGenerator:
+    def __init__(self, catalog_keys, seed=1, typo_rate=0.1, unknown_rate=0.03):
+        self.rng = random.Random(seed)
+        self.keys = sorted(catalog_keys)
+        self.typo_rate = typo_rate
+        self.unknown_rate = unknown_rate
+        self.plates = [random_plate(self.rng) for _ in range(300)]
+
+    def fragment(self):
+        rng = self.rng
+        if rng.random() < self.unknown_rate:
+            return rng.choice(UNKNOWN_FRAGMENTS)
+        fragment = rng.choice(self.keys)
+        if rng.random() < 0.1 and not fragment[0].isdigit():
+            fragment = f"{rng.randint(2, 4)} {fragment}"
+        if rng.random() < self.typo_rate:
+            fragment = add_typo(rng, fragment)
+        return fragment
+
+    def car_line(self):
+        rng = self.rng
+        parts = [self.fragment() for _ in range(rng.randint(1, 4))]
+        separator = rng.choice([", ", " , ", " и ", "; "])
+        return f"{rng.choice(self.plates)} {separator.join(parts)}"
+
+    def report(self, start=None, days=1, cars=(3, 10)):
+        """Текст отчета за days дней подряд, начиная со start."""
+        rng = self.rng
+        # без года парсер подставит текущий, поэтому по умолчанию берем текущий год
+        start = start or date(date.today().year, 7, 1)
+        lines = []
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            lines.append(f"{day.day}.{day.month:02d}" + (f".{day.year}" if rng.random() < 0.3 else ""))
+            lines.extend(self.car_line() for _ in range(rng.randint(*cars)))
+        return "\n".join(lines)
+
+    def reports(self, count, start=None, span_days=360, max_days=3):
+        start = start or date(date.today().year, 1, 1)
+        for _ in range(count):
+            day = start + timedelta(days=self.rng.randrange(span_days))
+            yield self.report(day, days=self.rng.randint(1, max_days))
@@ -1,18 +1,66 @@
+import argparse
 import asyncio
+import logging
 from aiogram import Bot, Dispatcher
 
 from config import BOT_TOKEN
-from db import init_db
-from handlers import router
+from db_async import init_db, check_query_plans, shutdown as shutdown_db
+from handlers import router, album_collector
+from export_jobs import export_queue
+from outbound import OutboundRateLimiter
+from metrics import HandlerMetricsMiddleware, start_metrics_server, METRICS_HOST, METRICS_PORT
+from user_context import UserContextMiddleware
+from fsm_storage import SQLiteStorage
+from unknown_services import flush_periodically, recorder as unknown_recorder
 
-async def main():
-    init_db()
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()  # <- без аргументов
+logger = logging.getLogger("bot")
+
+def create_dispatcher():
+    # Состояния диалогов хранятся в БД: переживают перезапуск и общие для всех процессов
+    dp = Dispatcher(storage=SQLiteStorage())
+    dp.update.outer_middleware(UserContextMiddleware())
+    # Внутренние middleware Dispatcher применяются ко всем вложенным роутерам
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
     dp.include_router(router)
+    return dp
+
+async def main(webhook=False, record=None):
+    await init_db()
+    for name, detail in await check_query_plans():
+        logger.warning("full table scan query=%s detail=%s", name, detail)
+    bot = Bot(token=BOT_TOKEN)
+    bot.session.middleware(OutboundRateLimiter())
+    dp = create_dispatcher()
+
+    flush_task = asyncio.create_task(flush_periodically())
+    export_queue.start(bot)
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        logger.info("metrics endpoint url=http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
 
-    print("🚀 Бот запущен...")
-    await dp.start_polling(bot)  # <- бот передается здесь
+    logger.info("🚀 Бот запущен...")
+    try:
+        if webhook:
+            from webhook import run_webhook
+            await run_webhook(dp, bot, record=record)
+        else:
+            await dp.start_polling(bot)  # <- бот передается здесь
+    finally:
+        flush_task.cancel()
+        await album_collector.drain()  # ответы на альбомы, пришедшие перед остановкой
+        await export_queue.stop()  # недособранные выгрузки продолжатся после перезапуска
+        await bot.session.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        unknown_recorder.flush()
+        shutdown_db()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    arg_parser = argparse.ArgumentParser(description="Бот учета оклейки")
+    arg_parser.add_argument("--webhook", action="store_true", help="принимать апдейты через webhook, а не polling")
+    arg_parser.add_argument("--record", help="дописывать принятые через webhook апдейты в этот JSONL")
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    asyncio.run(main(args.webhook, args.record))
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+MATERIALS_FILE = "materials.json"
+STAT_INTERVAL = 1.0  # не чаще раза в секунду проверяем mtime файла
+
+
+def normalize(s):
+    return " ".join(s.strip().lower().split())
+
+
+class Catalog:
+    """Неизменяемый снимок прайса из materials.json."""
+
+    def __init__(self, raw: bytes, mtime: float):
+        data = json.loads(raw.decode("utf-8"))
+        self.raw = raw
+        self.mtime = mtime
+        self.digest = hashlib.sha1(raw).hexdigest()
+        self.elements = {normalize(k): v for k, v in data.get("elements", {}).items()}
+        self.labor = {normalize(k): v for k, v in data.get("labor", {}).items()}
+        self.price_per_m2 = data.get("pricing", {}).get("area_cost_per_m2", 360)
+        self._version = None
+        self._matcher = None
+
+    @property
+    def version(self):
+        # Номер версии прайса выдает БД (таблица catalog_versions), поэтому
+        # одинаковое содержимое файла всегда получает один и тот же номер.
+        if self._version is None:
+            from db import register_catalog_version
+            self._version = register_catalog_version(self.digest, self.raw.decode("utf-8"))
+        return self._version
+
+    @property
+    def matcher(self):
+        # Компилируется один раз на снимок прайса
+        if self._matcher is None:
+            from matcher import ServiceMatcher
+            self._matcher = ServiceMatcher(self.elements, self.labor)
+        return self._matcher
+
+    def as_tuple(self):
+        return self.elements, self.labor, self.price_per_m2
+
+
+_lock = threading.Lock()
+_current = None
+_checked_at = 0.0
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    return raw, os.stat(path).st_mtime
+
+
+def get_catalog(path=MATERIALS_FILE) -> Catalog:
+    """Текущий прайс; файл перечитывается только если изменился."""
+    global _current, _checked_at
+    catalog = _current
+    now = time.monotonic()
+    if catalog is not None and now - _checked_at < STAT_INTERVAL:
+        return catalog
+    _checked_at = now
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        if catalog is not None:
+            return catalog
+        raise
+    if catalog is not None and mtime == catalog.mtime:
+        return catalog
+    return reload_catalog(path)
+
+
+def reload_catalog(path=MATERIALS_FILE, force=False) -> Catalog:
+    """Перечитывает файл и атомарно подменяет текущий снимок.
+
+    Если содержимое не изменилось (совпал хэш), остается прежний снимок.
+    """
+    global _current, _checked_at
+    with _lock:
+        raw, mtime = _read(path)
+        old = _current
+        if old is not None and not force and hashlib.sha1(raw).hexdigest() == old.digest:
+            old.mtime = mtime
+            return old
+        catalog = Catalog(raw, mtime)
+        if old is not None and catalog.digest == old.digest:
+            catalog._version = old._version
+        _current = catalog
+        _checked_at = time.monotonic()
+        return catalog
+
+
+def _per_unit(value, qty):
+    if not value or qty == 1:
+        return value
+    value = value / qty
+    return int(value) if value == int(value) else round(value, 4)
+
+
+def add_alias(fragment, target, path=MATERIALS_FILE) -> Catalog:
+    """Добавляет в прайс фрагмент с площадью и ценой работ target за одну штуку.
+
+    Количество из фрагмента отбрасывается: "10 элементов" из /unknown
+    добавляется как "элементов", число матчер разберет сам. Если количество
+    есть в самом ключе прайса ("8 элементов"), его значения делятся на это
+    количество, иначе число из отчета умножилось бы на уже учтенное в ключе.
+    """
+    from matcher import split_quantity
+    _, fragment = split_quantity(normalize(fragment))
+    target = normalize(target)
+    qty, _ = split_quantity(target)
+    with _lock:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        found = False
+        for section in ("elements", "labor"):
+            values = {normalize(k): v for k, v in data.get(section, {}).items()}
+            if target in values:
+                data.setdefault(section, {})[fragment] = _per_unit(values[target], qty)
+                found = True
+        if not found:
+            raise KeyError(target)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, path)
+    return reload_catalog(path)
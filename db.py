@@ -1,15 +1,167 @@
+import json
+import logging
+import os
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from datetime import date as _date, datetime, timedelta
+from functools import lru_cache
+
+from catalog import normalize
+from parser import content_hash
+from metrics import DB_SECONDS, DB_SLOW
 
 DB_NAME = "carwrap.db"
+DB_POOL_SIZE = 4  # число потоков (и соединений) для запросов из бота
+PHOTO_BUFFER_TTL = 24 * 3600  # фото без отчета дольше суток не привязываются
+PHOTO_BUFFER_LIMIT = 100  # последних фото на сотрудника, более старые вытесняются
+
+PRAGMAS = (
+    # Для новой БД; существующую archive.py переводит в этот режим одним VACUUM
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=67108864",
+)
+
+SLOW_QUERY_SECONDS = 0.1  # запросы дольше пишутся в лог с уровнем WARNING
+
+ARCHIVE_DIR = "archive"  # каталог архивов рядом с файлом БД
+MAX_ATTACHED = 9  # SQLite разрешает 10 ATTACH на соединение, один остается archive.py
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_connections = {}  # поток -> его соединение
+_connections_lock = threading.Lock()
+
+@lru_cache(maxsize=1024)
+def _statement_label(sql):
+    # Метка для метрик: команда и первая таблица, без параметров и пробелов
+    words = sql.split()
+    command = words[0].upper() if words else ""
+    table = re.search(r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+([\w.]+)", sql, re.IGNORECASE)
+    return f"{command} {table.group(1)}" if table else command
+
+def _timed(method, sql, params, label=None):
+    start = time.perf_counter()
+    try:
+        return method(sql, params)
+    finally:
+        elapsed = time.perf_counter() - start
+        label = label or _statement_label(sql)
+        DB_SECONDS.observe(elapsed, label)
+        if elapsed >= SLOW_QUERY_SECONDS:
+            DB_SLOW.inc(1, label)
+            logger.warning("slow query statement=%r seconds=%.3f sql=%r",
+                           label, elapsed, " ".join(sql.split())[:300])
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, который замеряет каждый запрос (время до первой строки результата)."""
+
+    def execute(self, sql, params=()):
+        return _timed(super().execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return _timed(super().executemany, sql, seq_of_params)
+
+class TimedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attached = {}  # имя схемы -> файл архива
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        return _timed(lambda sql, _: sqlite3.Connection.executescript(self, sql), script, None, "SCRIPT")
+
+def _connect(db_name):
+    conn = sqlite3.connect(db_name, check_same_thread=False, factory=TimedConnection)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _connections_lock:
+        # Соединения завершившихся потоков закрываем, чтобы их число не росло
+        for thread in [t for t in _connections if not t.is_alive()]:
+            _connections.pop(thread).close()
+        _connections[threading.current_thread()] = conn
+    return conn
 
 def get_connection():
-    return sqlite3.connect(DB_NAME)
+    # У каждого потока свое долгоживущее соединение: `with conn:` только
+    # коммитит транзакцию, а не закрывает соединение. Из бота запросы идут
+    # через пулы db_async (run_db, run_export), поэтому число соединений
+    # ограничено размерами пулов.
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(DB_NAME)
+    if conn is None:
+        conn = conns[DB_NAME] = _connect(DB_NAME)
+    return conn
+
+def close_connections():
+    with _connections_lock:
+        for conn in _connections.values():
+            conn.close()
+        _connections.clear()
 
 def init_db():
-    with get_connection() as conn:
-        with open("models.sql", "r", encoding="utf-8") as f:
-            conn.executescript(f.read())
+    """Доводит схему БД до последней версии (migrations.py)."""
+    # migrations сам импортирует db, поэтому импорт здесь, а не в начале модуля
+    from migrations import migrate
+    migrate(get_connection())
+
+ROLLUP_CARS_SQL = """
+    SELECT reports.date AS date, IFNULL(reports.user_id, 0) AS user_id,
+           IFNULL(cars.license_plate, '') AS license_plate, cars.area AS area, cars.cost AS cost,
+           cars.labor_cost AS labor_cost
+    FROM {db}.cars AS cars JOIN {db}.reports AS reports ON cars.report_id = reports.id
+    WHERE reports.date IS NOT NULL
+"""
+
+def fill_rollups(conn, cars, date_from=None, date_to=None):
+    """Заполняет сводки заново по запросу машин в формате ROLLUP_CARS_SQL, без COMMIT.
+
+    С периодом заменяются только дни [date_from, date_to); запрос машин
+    тогда ограничен тем же периодом через :date_from и :date_to.
+    """
+    params = {"date_from": date_from, "date_to": date_to}
+    days = "" if date_from is None else " WHERE date >= :date_from AND date < :date_to"
+    conn.execute("DELETE FROM daily_rollup" + days, params)
+    conn.execute("DELETE FROM daily_plates" + days, params)
+    conn.execute(f"""
+        INSERT INTO daily_rollup (date, user_id, cars_count, area, cost, labor_cost)
+        SELECT date, user_id, COUNT(*), IFNULL(SUM(area), 0), IFNULL(SUM(cost), 0), IFNULL(SUM(labor_cost), 0)
+        FROM ({cars})
+        GROUP BY date, user_id
+    """, params)
+    conn.execute(f"""
+        INSERT INTO daily_plates (date, user_id, license_plate, cars_count)
+        SELECT date, user_id, license_plate, COUNT(*)
+        FROM ({cars})
+        GROUP BY date, user_id, license_plate
+    """, params)
+
+def rebuild_rollups(conn, date_from=None, date_to=None):
+    """Пересчитывает сводки по машинам основной БД и архивов (всех или за период), без COMMIT.
+
+    Внутри транзакции нужные архивы должны быть подключены заранее.
+    """
+    template = ROLLUP_CARS_SQL
+    if date_from is not None:
+        template += "      AND reports.date >= :date_from AND reports.date < :date_to\n"
+    fill_rollups(conn, _union(conn, template, date_from, date_to), date_from, date_to)
 
 def add_user(tg_id, name):
     with get_connection() as conn:
@@ -17,6 +169,24 @@ def add_user(tg_id, name):
         cursor.execute("INSERT OR IGNORE INTO users (tg_id, name) VALUES (?, ?)", (tg_id, name))
         conn.commit()
 
+def resolve_user(tg_id, name, seen_at=None):
+    """Регистрирует пользователя; возвращает (id, name, is_admin).
+
+    seen_at — время сообщения, из которого взято имя (по умолчанию сейчас).
+    Имя меняется, только если его нет или сообщение новее того, из которого
+    взято сохраненное: импорт старой истории не откатывает переименование.
+    """
+    seen_at = time.time() if seen_at is None else seen_at
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO users (tg_id, name, name_seen_at) VALUES (?, ?, ?)
+            ON CONFLICT(tg_id) DO UPDATE SET name = excluded.name, name_seen_at = excluded.name_seen_at
+            WHERE excluded.name IS NOT NULL
+              AND (users.name IS NULL OR IFNULL(users.name_seen_at, 0) < excluded.name_seen_at)
+        """, (tg_id, name, seen_at))
+        row = conn.execute("SELECT id, name, is_admin FROM users WHERE tg_id = ?", (tg_id,)).fetchone()
+        return row[0], row[1], bool(row[2])
+
 def set_admin(tg_id):
     with get_connection() as conn:
         conn.execute("UPDATE users SET is_admin = 1 WHERE tg_id = ?", (tg_id,))
@@ -28,7 +198,7 @@ def is_admin(tg_id):
         cur.execute("SELECT is_admin FROM users WHERE tg_id = ?", (tg_id,))
         row = cur.fetchone()
         result = row and row[0] == 1
-        print(f"is_admin check for {tg_id}: {result}")
+        logger.debug("is_admin tg_id=%s result=%s", tg_id, result)
         return result
 
 def get_user_id(tg_id):
@@ -38,13 +208,334 @@ def get_user_id(tg_id):
         row = cur.fetchone()
         return row[0] if row else None
 
-def add_report(user_id, date):
+def add_report(user_id, date, catalog_version=None):
     with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute("INSERT INTO reports (user_id, date) VALUES (?, ?)", (user_id, date))
+        cur.execute(
+            "INSERT INTO reports (user_id, date, catalog_version) VALUES (?, ?, ?)",
+            (user_id, date, catalog_version)
+        )
         conn.commit()
         return cur.lastrowid
 
+def ingest_report(user_id, date, cars, photos=(), catalog_version=None, buffer_tg_id=None):
+    """Записывает отчет, его машины и фото одной транзакцией.
+
+    buffer_tg_id — забрать в отчет и фото из буфера этого сотрудника; при
+    ошибке записи они остаются в буфере. Машины, уже записанные раньше
+    (тот же content_hash), пропускаются. Возвращает (report_id, car_ids,
+    photo_ids, duplicates); report_id — None, если записывать было нечего.
+    """
+    conn = get_connection()
+    with conn:
+        # Блокировка записи сразу: между проверкой отпечатков и вставкой никто не вклинится
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.cursor()
+        if buffer_tg_id is not None:
+            photos = list(photos) + _take_buffered_photos(cur, buffer_tg_id)
+        return _insert_report(cur, user_id, date, cars, photos, catalog_version)
+
+def buffer_photos(tg_id, file_ids, limit=PHOTO_BUFFER_LIMIT, ttl=PHOTO_BUFFER_TTL):
+    """Кладет фото в буфер сотрудника; возвращает, сколько фото в нем ждет отчета."""
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM photo_buffer WHERE added_at < ?", (now - ttl,))
+        conn.executemany("INSERT INTO photo_buffer (tg_id, file_id, added_at) VALUES (?, ?, ?)",
+                         [(tg_id, file_id, now) for file_id in file_ids])
+        conn.execute("""
+            DELETE FROM photo_buffer WHERE tg_id = ? AND id NOT IN (
+                SELECT id FROM photo_buffer WHERE tg_id = ? ORDER BY id DESC LIMIT ?
+            )
+        """, (tg_id, tg_id, limit))
+        return conn.execute("SELECT COUNT(*) FROM photo_buffer WHERE tg_id = ?", (tg_id,)).fetchone()[0]
+
+def _take_buffered_photos(cur, tg_id, ttl=PHOTO_BUFFER_TTL):
+    # DELETE ... RETURNING забирает фото атомарно: два процесса не получат одно фото дважды
+    rows = cur.execute("DELETE FROM photo_buffer WHERE tg_id = ? RETURNING id, file_id, added_at",
+                       (tg_id,)).fetchall()
+    cutoff = time.time() - ttl
+    return [file_id for _, file_id, added_at in sorted(rows) if added_at >= cutoff]
+
+def get_fsm_record(key):
+    """key — (bot_id, chat_id, user_id, thread_id, destiny); возвращает (state, data)."""
+    row = get_connection().execute("""
+        SELECT state, data FROM fsm_states
+        WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+    """, key).fetchone()
+    if row is None:
+        return None, {}
+    return row[0], json.loads(row[1])
+
+def set_fsm_state(key, state):
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, state, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny)
+            DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        """, (*key, state, time.time()))
+        _delete_empty_fsm_record(conn, key)
+
+def set_fsm_data(key, data):
+    conn = get_connection()
+    with conn:
+        _write_fsm_data(conn, key, data)
+
+def update_fsm_data(key, data):
+    """Слияние с сохраненными данными под блокировкой записи; возвращает итог."""
+    conn = get_connection()
+    with conn:
+        # Блокировка с самого начала, иначе другой процесс успеет записать между чтением и записью
+        conn.execute("BEGIN IMMEDIATE")
+        merged = get_fsm_record(key)[1]
+        merged.update(data)
+        _write_fsm_data(conn, key, merged)
+        return merged
+
+def _write_fsm_data(conn, key, data):
+    conn.execute("""
+        INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, data, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny)
+        DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+    """, (*key, json.dumps(data, ensure_ascii=False), time.time()))
+    _delete_empty_fsm_record(conn, key)
+
+def _delete_empty_fsm_record(conn, key):
+    conn.execute("""
+        DELETE FROM fsm_states
+        WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+          AND state IS NULL AND data = '{}'
+    """, key)
+
+def ingest_reports(reports):
+    """Пакетная запись отчетов одной транзакцией.
+
+    reports: [(user_id, date, cars, photos, catalog_version, source)]. Отчеты,
+    чей source уже загружен, пропускаются (None в результате), для остальных
+    возвращается то же, что у ingest_report.
+    """
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.cursor()
+        return [_insert_report(cur, *report) for report in reports]
+
+def _insert_report(cur, user_id, date, cars, photos, catalog_version, source=None):
+    fresh, duplicates = _split_duplicates(cur, user_id, date, cars)
+    if cars and not fresh and not photos:
+        # Отчет целиком повторяет уже записанный
+        if source is not None and _source_exists(cur, source):
+            return None
+        return None, [], [], duplicates
+    cur.execute(
+        "INSERT OR IGNORE INTO reports (user_id, date, catalog_version, source) VALUES (?, ?, ?, ?)",
+        (user_id, date, catalog_version, source)
+    )
+    if cur.rowcount == 0:
+        return None
+    report_id = cur.lastrowid
+    car_ids = _insert_many(cur, """
+        INSERT INTO cars (report_id, license_plate, description, area, cost, labor_cost, content_hash, unknown_parts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(report_id, car["plate"], car["description"], car["area"], car["cost"], car["labor_cost"], digest,
+           _unknown_parts(car))
+          for car, digest in fresh])
+    photo_ids = _insert_many(cur, "INSERT INTO photos (report_id, file_id) VALUES (?, ?)",
+                             [(report_id, file_id) for file_id in photos])
+    _insert_car_items(cur, zip(car_ids, (car for car, _ in fresh)), catalog_version)
+    return report_id, car_ids, photo_ids, duplicates
+
+def _unknown_parts(car):
+    # Машина не из разбора описания (нет "unknown") — позиции пересчет восстановит сам
+    return len(car["unknown"]) if "unknown" in car else None
+
+def _source_exists(cur, source):
+    return cur.execute("SELECT 1 FROM reports WHERE source = ?", (source,)).fetchone() is not None
+
+def _split_duplicates(cur, user_id, date, cars):
+    """([(машина, отпечаток)] новых, [машины]) — дубликаты и в БД, и внутри самого отчета."""
+    digests = [content_hash(user_id, date, car["plate"], car["description"]) for car in cars]
+    seen = set()
+    for start in range(0, len(digests), 500):
+        chunk = digests[start:start + 500]
+        # Машины закрытых месяцев лежат в архивах, их отпечатки — в archived_hashes
+        for table in ("cars", "archived_hashes"):
+            seen.update(row[0] for row in cur.execute(
+                f"SELECT content_hash FROM {table} WHERE content_hash IN ({','.join('?' * len(chunk))})", chunk))
+    fresh, duplicates = [], []
+    for car, digest in zip(cars, digests):
+        if digest in seen:
+            duplicates.append(car)
+        else:
+            seen.add(digest)
+            fresh.append((car, digest))
+    return fresh, duplicates
+
+_catalog_prices = {}  # версия прайса -> {ключ: (площадь, работы)}; версии не меняются
+
+def _get_catalog_prices(cur, catalog_version):
+    prices = _catalog_prices.get(catalog_version)
+    if prices is None:
+        prices = {key: (area, labor_cost) for key, area, labor_cost in cur.execute(
+            "SELECT key, area, labor_cost FROM catalog_items WHERE catalog_version = ?", (catalog_version,))}
+        if prices:
+            _catalog_prices[catalog_version] = prices
+    return prices
+
+def _insert_car_items(cur, cars, catalog_version):
+    """Позиции машин [(car_id, car)] по car["items"]; площадь и работы — по версии прайса."""
+    rows = {}
+    for car_id, car in cars:
+        for key, qty in car.get("items", ()):
+            rows[car_id, key] = rows.get((car_id, key), 0) + qty
+    if not rows:
+        return
+    prices = _get_catalog_prices(cur, catalog_version) if catalog_version is not None else {}
+    items = []
+    for (car_id, key), qty in rows.items():
+        area, labor_cost = prices.get(key, (0, 0))
+        items.append((car_id, key, catalog_version, qty, qty * area, qty * labor_cost))
+    cur.executemany(
+        "INSERT INTO car_items (car_id, catalog_key, catalog_version, qty, area, labor_cost) VALUES (?, ?, ?, ?, ?, ?)",
+        items
+    )
+
+def replace_car_items(cars, catalog_version):
+    """Заменяет позиции машин [(car_id, car)] заново разобранными описаниями (см. repricing)."""
+    conn = get_connection()
+    with conn:
+        cur = conn.cursor()
+        cur.executemany("DELETE FROM car_items WHERE car_id = ?", [(car_id,) for car_id, _ in cars])
+        _insert_car_items(cur, cars, catalog_version)
+        cur.executemany("UPDATE cars SET unknown_parts = ? WHERE id = ?",
+                        [(len(car["unknown"]), car_id) for car_id, car in cars])
+
+def get_cars_to_reparse(date_from, date_to, after_id=0, limit=500):
+    """(car_id, license_plate, description, date) машин периода, чьи позиции надо разобрать заново.
+
+    Это машины с нераспознанными фрагментами (их мог распознать новый алиас
+    прайса) и машины, описание которых в позиции еще не разбиралось
+    (unknown_parts IS NULL). Порядок — по возрастанию id.
+    """
+    return get_connection().execute("""
+        SELECT cars.id, cars.license_plate, cars.description, reports.date
+        FROM reports JOIN cars ON cars.report_id = reports.id
+        WHERE reports.date >= ? AND reports.date < ? AND cars.id > ?
+          AND (cars.unknown_parts IS NULL OR cars.unknown_parts > 0)
+        ORDER BY cars.id
+        LIMIT ?
+    """, (*day_range(date_from, date_to), after_id, limit)).fetchall()
+
+REPRICE_ITEMS_SQL = """
+    UPDATE car_items SET
+        catalog_version = :version,
+        area = car_items.qty * catalog_items.area,
+        labor_cost = car_items.qty * catalog_items.labor_cost
+    FROM catalog_items, cars, reports
+    WHERE catalog_items.catalog_version = :version AND catalog_items.key = car_items.catalog_key
+      AND cars.id = car_items.car_id AND reports.id = cars.report_id
+      AND reports.date >= :date_from AND reports.date < :date_to
+"""
+
+REPRICE_CARS_SQL = """
+    UPDATE cars SET area = totals.area, cost = totals.cost, labor_cost = totals.labor_cost
+    FROM (
+        SELECT car_items.car_id,
+               ROUND(SUM(car_items.area), 2) AS area,
+               CAST(ROUND(SUM(car_items.area) * :price) AS INTEGER) AS cost,
+               CAST(ROUND(SUM(car_items.labor_cost)) AS INTEGER) AS labor_cost
+        FROM reports
+        JOIN cars ON cars.report_id = reports.id
+        JOIN car_items ON car_items.car_id = cars.id
+        WHERE reports.date >= :date_from AND reports.date < :date_to
+        GROUP BY car_items.car_id
+    ) AS totals
+    WHERE cars.id = totals.car_id
+      AND (cars.area IS NOT totals.area OR cars.cost IS NOT totals.cost
+           OR cars.labor_cost IS NOT totals.labor_cost)
+"""
+
+def reprice_cars(date_from, date_to, catalog_version):
+    """Пересчитывает позиции и итоги машин периода по версии прайса.
+
+    Пересчет — три UPDATE в одной транзакции, сводки daily_rollup
+    обновляют триггеры. Позиции, которых нет в этой версии прайса,
+    сохраняют прежние значения. Возвращает (позиций, машин изменено).
+    """
+    date_from, date_to = day_range(date_from, date_to)
+    params = {"version": catalog_version, "date_from": date_from, "date_to": date_to}
+    conn = get_connection()
+    with conn:
+        price = conn.execute("SELECT price_per_m2 FROM catalog_versions WHERE id = ?",
+                             (catalog_version,)).fetchone()[0]
+        items = conn.execute(REPRICE_ITEMS_SQL, params).rowcount
+        cars = conn.execute(REPRICE_CARS_SQL, {**params, "price": price}).rowcount
+        conn.execute("""
+            UPDATE reports SET catalog_version = :version
+            WHERE date >= :date_from AND date < :date_to AND catalog_version IS NOT :version
+        """, params)
+    return items, cars
+
+ITEM_CONSUMPTION_SQL = """
+    SELECT car_items.catalog_key AS catalog_key, car_items.qty AS qty, car_items.area AS area,
+           car_items.labor_cost AS labor_cost
+    FROM {db}.reports AS reports
+    JOIN {db}.cars AS cars ON cars.report_id = reports.id
+    JOIN {db}.car_items AS car_items ON car_items.car_id = cars.id
+    LEFT JOIN users ON reports.user_id = users.id
+    WHERE reports.date >= :date_from AND reports.date < :date_to
+      AND (:tg_id IS NULL OR users.tg_id = :tg_id)
+"""
+
+def get_item_consumption(date_from, date_to, user_id=None):
+    """Расход по позициям прайса за период: [(ключ, количество, площадь, работы)]."""
+    start, end = day_range(date_from, date_to)
+    params = {"date_from": start, "date_to": end, "tg_id": user_id or None}
+    conn = get_connection()
+    items = _union(conn, ITEM_CONSUMPTION_SQL, start, end)
+    return conn.execute(f"""
+        SELECT catalog_key, SUM(qty), SUM(area), SUM(labor_cost)
+        FROM ({items})
+        GROUP BY catalog_key
+        ORDER BY SUM(area) DESC
+    """, params).fetchall()
+
+def _insert_many(cur, query, rows):
+    if not rows:
+        return []
+    cur.executemany(query, rows)
+    # Внутри одной транзакции писатель единственный, поэтому id новых строк идут подряд
+    last_id = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+def register_catalog_version(digest, content):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT OR IGNORE INTO catalog_versions (digest, content, loaded_at) VALUES (?, ?, ?)",
+            (digest, content, datetime.now().isoformat(timespec="seconds"))
+        )
+        if cur.rowcount:
+            insert_catalog_items(cur, cur.lastrowid, content)
+        cur.execute("SELECT id FROM catalog_versions WHERE digest = ?", (digest,))
+        conn.commit()
+        return cur.fetchone()[0]
+
+def insert_catalog_items(cur, version_id, content):
+    # Ключи нормализуются так же, как в catalog.Catalog
+    data = json.loads(content)
+    elements = {normalize(k): v for k, v in data.get("elements", {}).items()}
+    labor = {normalize(k): v for k, v in data.get("labor", {}).items()}
+    cur.executemany(
+        "INSERT OR REPLACE INTO catalog_items (catalog_version, key, area, labor_cost) VALUES (?, ?, ?, ?)",
+        [(version_id, key, elements.get(key) or 0, labor.get(key) or 0) for key in elements.keys() | labor.keys()]
+    )
+    cur.execute("UPDATE catalog_versions SET price_per_m2 = ? WHERE id = ?",
+                (data.get("pricing", {}).get("area_cost_per_m2", 360), version_id))
+
 def add_car(report_id, plate, description, area, cost, labor_cost):
     with get_connection() as conn:
         conn.execute(
@@ -58,22 +549,575 @@ def add_photo(report_id, file_id):
         conn.execute("INSERT INTO photos (report_id, file_id) VALUES (?, ?)", (report_id, file_id))
         conn.commit()
 
-def get_photos_by_date(date):
+def record_unknown_services(rows):
+    """rows: [(фрагмент, номер машины, user_id, дата)] — пишутся одной транзакцией."""
+    if not rows:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany("""
+            INSERT INTO unknown_services (fragment, count, first_seen, last_seen) VALUES (?, 1, ?, ?)
+            ON CONFLICT(fragment) DO UPDATE SET
+                count = count + 1,
+                first_seen = CASE WHEN first_seen IS NULL OR excluded.first_seen < first_seen
+                                  THEN excluded.first_seen ELSE first_seen END,
+                last_seen = CASE WHEN last_seen IS NULL OR excluded.last_seen > last_seen
+                                 THEN excluded.last_seen ELSE last_seen END
+        """, [(fragment, date, date) for fragment, plate, user_id, date in rows])
+        conn.executemany("""
+            INSERT INTO unknown_service_sources (fragment, license_plate, user_id, count) VALUES (?, ?, ?, 1)
+            ON CONFLICT(fragment, license_plate, user_id) DO UPDATE SET count = count + 1
+        """, [(fragment, plate or "", user_id or 0) for fragment, plate, user_id, date in rows])
+
+def get_top_unknown_services(limit=10):
+    """[(фрагмент, сколько раз, первый раз, последний раз, номера, сотрудники)]."""
+    return get_connection().execute("""
+        SELECT u.fragment, u.count, u.first_seen, u.last_seen,
+               (SELECT GROUP_CONCAT(license_plate, ', ') FROM (
+                    SELECT DISTINCT license_plate FROM unknown_service_sources
+                    WHERE fragment = u.fragment AND license_plate <> '')),
+               (SELECT GROUP_CONCAT(name, ', ') FROM (
+                    SELECT DISTINCT users.name FROM unknown_service_sources AS s
+                    JOIN users ON users.id = s.user_id WHERE s.fragment = u.fragment))
+        FROM unknown_services AS u
+        ORDER BY u.count DESC
+        LIMIT ?
+    """, (limit,)).fetchall()
+
+def delete_unknown_service(fragment):
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM unknown_services WHERE fragment = ?", (fragment,))
+        conn.execute("DELETE FROM unknown_service_sources WHERE fragment = ?", (fragment,))
+
+def is_update_processed(update_id):
+    row = get_connection().execute(
+        "SELECT 1 FROM processed_updates WHERE update_id = ?", (update_id,)
+    ).fetchone()
+    return row is not None
+
+def mark_update_processed(update_id):
+    """Отмечает апдейт обработанным; False, если он уже был отмечен."""
+    conn = get_connection()
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO processed_updates (update_id, received_at) VALUES (?, ?)",
+            (update_id, time.time())
+        )
+        return cur.rowcount == 1
+
+def prune_processed_updates(max_age=86400):
+    """Удаляет старые update_id: Telegram не доставляет апдейты старше суток."""
+    conn = get_connection()
+    with conn:
+        return conn.execute("DELETE FROM processed_updates WHERE received_at < ?",
+                            (time.time() - max_age,)).rowcount
+
+EXPORT_ACTIVE = "('pending', 'running')"
+
+def enqueue_export(kind, params, chat_id, message_id):
+    """Ставит выгрузку в очередь или подписывает чат на такую же незаконченную.
+
+    params — JSON-строка параметров. Возвращает (job_id, создана ли новая задача).
+    """
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        created = conn.execute(f"""
+            INSERT INTO export_jobs (kind, params, status, created_at, run_after)
+            VALUES (?, ?, 'pending', ?, ?)
+            ON CONFLICT(kind, params) WHERE status IN {EXPORT_ACTIVE} DO NOTHING
+        """, (kind, params, now, now)).rowcount == 1
+        job_id = conn.execute(
+            f"SELECT id FROM export_jobs WHERE kind = ? AND params = ? AND status IN {EXPORT_ACTIVE}",
+            (kind, params)
+        ).fetchone()[0]
+        conn.execute("""
+            INSERT INTO export_subscribers (job_id, chat_id, message_id) VALUES (?, ?, ?)
+            ON CONFLICT(job_id, chat_id) DO UPDATE SET message_id = excluded.message_id
+        """, (job_id, chat_id, message_id))
+        return job_id, created
+
+def claim_export_job(lease):
+    """Берет в работу следующую выгрузку: ожидающую или брошенную (нет отметки дольше lease секунд).
+
+    Возвращает (job_id, kind, params, attempts) или None.
+    """
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        return conn.execute("""
+            UPDATE export_jobs SET status = 'running', attempts = attempts + 1, heartbeat_at = :now
+            WHERE id = (
+                SELECT id FROM export_jobs
+                WHERE (status = 'pending' AND run_after <= :now)
+                   OR (status = 'running' AND heartbeat_at < :stale)
+                ORDER BY id LIMIT 1
+            )
+            RETURNING id, kind, params, attempts
+        """, {"now": now, "stale": now - lease}).fetchone()
+
+def touch_export_job(job_id):
+    """Отметка, что выгрузка еще идет; False — ее отменили."""
+    conn = get_connection()
+    with conn:
+        return conn.execute(
+            "UPDATE export_jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+            (time.time(), job_id)
+        ).rowcount == 1
+
+def finish_export_job(job_id, status, error=None, retry_delay=None):
+    """Завершает выгрузку со статусом done/failed или, с retry_delay, возвращает ее в очередь."""
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        if retry_delay is not None:
+            conn.execute("""
+                UPDATE export_jobs SET status = 'pending', error = ?, run_after = ?
+                WHERE id = ? AND status = 'running'
+            """, (error, now + retry_delay, job_id))
+        else:
+            conn.execute("""
+                UPDATE export_jobs SET status = ?, error = ?, finished_at = ?
+                WHERE id = ? AND status = 'running'
+            """, (status, error, now, job_id))
+
+def release_export_job(job_id):
+    """Возвращает прерванную остановкой бота выгрузку в очередь без траты попытки."""
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            UPDATE export_jobs SET status = 'pending', attempts = MAX(attempts - 1, 0)
+            WHERE id = ? AND status = 'running'
+        """, (job_id,))
+
+def cancel_export(job_id, chat_id):
+    """Отписывает чат от выгрузки; последняя отписка отменяет саму выгрузку.
+
+    Возвращает (чат был подписан, выгрузка отменена).
+    """
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        removed = conn.execute("DELETE FROM export_subscribers WHERE job_id = ? AND chat_id = ?",
+                               (job_id, chat_id)).rowcount == 1
+        left = conn.execute("SELECT COUNT(*) FROM export_subscribers WHERE job_id = ?", (job_id,)).fetchone()[0]
+        cancelled = False
+        if not left:
+            cancelled = conn.execute(f"""
+                UPDATE export_jobs SET status = 'cancelled', finished_at = ?
+                WHERE id = ? AND status IN {EXPORT_ACTIVE}
+            """, (time.time(), job_id)).rowcount == 1
+        return removed, cancelled
+
+def get_export_job(job_id):
+    """(kind, params, status, error) выгрузки или None."""
+    return get_connection().execute(
+        "SELECT kind, params, status, error FROM export_jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+
+def get_export_subscribers(job_id):
+    """[(chat_id, message_id)] чатов, ждущих выгрузку."""
+    return get_connection().execute(
+        "SELECT chat_id, message_id FROM export_subscribers WHERE job_id = ?", (job_id,)
+    ).fetchall()
+
+def count_active_exports():
+    return get_connection().execute(
+        f"SELECT COUNT(*) FROM export_jobs WHERE status IN {EXPORT_ACTIVE}"
+    ).fetchone()[0]
+
+def get_export_artifact(kind, params, fingerprint):
+    """(тексты, [(file_id, подпись)]) готовой выгрузки, если данные периода с тех пор не менялись."""
+    row = get_connection().execute(
+        "SELECT texts, documents FROM export_artifacts WHERE kind = ? AND params = ? AND fingerprint = ?",
+        (kind, params, fingerprint)
+    ).fetchone()
+    return (json.loads(row[0]), json.loads(row[1])) if row else None
+
+def save_export_artifact(kind, params, fingerprint, texts, documents):
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO export_artifacts (kind, params, fingerprint, texts, documents, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (kind, params, fingerprint, json.dumps(texts, ensure_ascii=False),
+              json.dumps(documents, ensure_ascii=False), time.time()))
+
+def delete_export_artifact(kind, params):
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM export_artifacts WHERE kind = ? AND params = ?", (kind, params))
+
+def prune_export_jobs(job_ttl=7 * 86400, artifact_ttl=90 * 86400):
+    """Удаляет давно законченные выгрузки и старые готовые файлы."""
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.execute(f"""
+            DELETE FROM export_subscribers WHERE job_id IN (
+                SELECT id FROM export_jobs WHERE status NOT IN {EXPORT_ACTIVE} AND finished_at < ?
+            )
+        """, (now - job_ttl,))
+        jobs = conn.execute(f"DELETE FROM export_jobs WHERE status NOT IN {EXPORT_ACTIVE} AND finished_at < ?",
+                            (now - job_ttl,)).rowcount
+        conn.execute("DELETE FROM export_artifacts WHERE created_at < ?", (now - artifact_ttl,))
+        return jobs
+
+def day_range(date_from, date_to=None):
+    """Полуоткрытый диапазон [date_from, date_to + 1 день) для WHERE по reports.date."""
+    date_to = date_to or date_from
+    end = _date.fromisoformat(date_to) + timedelta(days=1)
+    return date_from, end.isoformat()
+
+def month_range(year, month):
+    year, month = int(year), int(month)
+    start = _date(year, month, 1)
+    end = _date(year + month // 12, month % 12 + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+# Схема файла архива: те же таблицы отчетов, машин, позиций и фото, без триггеров сводок
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    date TEXT,
+    catalog_version INTEGER,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS cars (
+    id INTEGER PRIMARY KEY,
+    report_id INTEGER,
+    license_plate TEXT,
+    description TEXT,
+    area REAL,
+    cost INTEGER,
+    labor_cost INTEGER DEFAULT 0,
+    content_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS photos (
+    id INTEGER PRIMARY KEY,
+    report_id INTEGER,
+    file_id TEXT
+);
+CREATE TABLE IF NOT EXISTS car_items (
+    car_id INTEGER NOT NULL,
+    catalog_key TEXT NOT NULL,
+    catalog_version INTEGER,
+    qty REAL NOT NULL,
+    area REAL NOT NULL,
+    labor_cost REAL NOT NULL,
+    PRIMARY KEY (car_id, catalog_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_reports_date ON reports(date);
+CREATE INDEX IF NOT EXISTS idx_cars_report_id ON cars(report_id);
+CREATE INDEX IF NOT EXISTS idx_photos_report_id ON photos(report_id);
+"""
+
+def archive_file(year):
+    """Файл архива за год, относительно файла БД (так он хранится в таблице archives)."""
+    return os.path.join(ARCHIVE_DIR, f"carwrap_{year}.db")
+
+def _archive_path(path):
+    return os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), path)
+
+def _schema_name(path):
+    return "archive_" + re.sub(r"\W", "_", os.path.splitext(os.path.basename(path))[0])
+
+def attach_archive(conn, path):
+    """ATTACH файла архива к соединению, если он еще не подключен; возвращает имя схемы.
+
+    ATTACH и DETACH нельзя выполнять внутри транзакции.
+    """
+    schema = _schema_name(path)
+    if schema not in conn.attached:
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (_archive_path(path),))
+        conn.attached[schema] = path
+    return schema
+
+def detach_archives(conn):
+    for schema in list(conn.attached):
+        conn.execute(f"DETACH DATABASE {schema}")
+        del conn.attached[schema]
+
+def _archive_schemas(conn, date_from=None, date_to=None):
+    """Подключает архивы, пересекающиеся с периодом (все — без периода); возвращает имена схем."""
+    query = "SELECT DISTINCT path FROM archives"
+    params = {}
+    if date_from is not None:
+        query += " WHERE date_from < :date_to AND date_to > :date_from"
+        params = {"date_from": date_from, "date_to": date_to}
+    paths = [row[0] for row in conn.execute(query + " ORDER BY path", params)]
+    if len(paths) > MAX_ATTACHED:
+        raise ValueError(f"Период захватывает {len(paths)} архивов, больше {MAX_ATTACHED}")
+    needed = {_schema_name(path) for path in paths}
+    if len(needed | conn.attached.keys()) > MAX_ATTACHED:
+        for schema in conn.attached.keys() - needed:
+            conn.execute(f"DETACH DATABASE {schema}")
+            del conn.attached[schema]
+    return [attach_archive(conn, path) for path in paths]
+
+def _union(conn, template, date_from=None, date_to=None):
+    """template по основной БД и нужным архивам, склеенный через UNION ALL."""
+    schemas = ["main"] + _archive_schemas(conn, date_from, date_to)
+    return "\nUNION ALL\n".join(template.format(db=schema) for schema in schemas)
+
+def get_archivable_periods(before):
+    """Месяцы ('ГГГГ-ММ') с отчетами в основной БД, целиком раньше даты before."""
+    rows = get_connection().execute("""
+        SELECT DISTINCT substr(date, 1, 7) FROM reports
+        WHERE date < :before
+        ORDER BY 1
+    """, {"before": before[:7] + "-01"}).fetchall()
+    return [row[0] for row in rows]
+
+def archive_period(period, path=None):
+    """Переносит отчеты месяца period ('ГГГГ-ММ') с машинами, позициями и фото в файл архива.
+
+    Файл архива подключается через ATTACH, затем копирование, сверка числа
+    строк, удаление из основной БД и пересчет сводок месяца идут одной
+    транзакцией: при ошибке не меняется ни один файл. В режиме WAL файлы
+    фиксируются по очереди, поэтому если процесс упадет в самый момент
+    COMMIT, повторный запуск перезапишет строки архива по id и доведет перенос.
+
+    Сводки daily_rollup/daily_plates за месяц остаются в основной БД, поэтому
+    итоги за любой период по-прежнему считаются без ATTACH. Там же остаются
+    отпечатки машин (archived_hashes): повторно присланный отчет за архивный
+    месяц не запишется второй раз. Возвращает (отчетов, машин, фото).
+    """
+    start, end = month_range(*period.split("-"))
+    path = path or archive_file(period[:4])
+    os.makedirs(os.path.dirname(_archive_path(path)), exist_ok=True)
+    with sqlite3.connect(_archive_path(path)) as archive:
+        archive.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        archive.executescript(ARCHIVE_SCHEMA)
+    archive.close()
+
+    conn = get_connection()
+    # ATTACH нельзя выполнить внутри транзакции
+    schema = attach_archive(conn, path)
+    params = {"date_from": start, "date_to": end}
+    report_ids = "SELECT id FROM main.reports WHERE date >= :date_from AND date < :date_to"
+    car_ids = f"SELECT id FROM main.cars WHERE report_id IN ({report_ids})"
+    counts = {
+        "reports": report_ids,
+        "cars": car_ids,
+        "car_items": f"SELECT car_id FROM main.car_items WHERE car_id IN ({car_ids})",
+        "photos": f"SELECT id FROM main.photos WHERE report_id IN ({report_ids})",
+    }
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f"""
+            INSERT OR REPLACE INTO {schema}.reports (id, user_id, date, catalog_version, source)
+            SELECT id, user_id, date, catalog_version, source FROM main.reports
+            WHERE date >= :date_from AND date < :date_to
+        """, params)
+        conn.execute(f"""
+            INSERT OR REPLACE INTO {schema}.cars
+                (id, report_id, license_plate, description, area, cost, labor_cost, content_hash)
+            SELECT id, report_id, license_plate, description, area, cost, labor_cost, content_hash
+            FROM main.cars WHERE report_id IN ({report_ids})
+        """, params)
+        conn.execute(f"""
+            INSERT OR REPLACE INTO {schema}.car_items (car_id, catalog_key, catalog_version, qty, area, labor_cost)
+            SELECT car_id, catalog_key, catalog_version, qty, area, labor_cost
+            FROM main.car_items WHERE car_id IN ({car_ids})
+        """, params)
+        conn.execute(f"""
+            INSERT OR REPLACE INTO {schema}.photos (id, report_id, file_id)
+            SELECT id, report_id, file_id FROM main.photos WHERE report_id IN ({report_ids})
+        """, params)
+        for table, ids in counts.items():
+            key = "car_id" if table == "car_items" else "id"
+            source = conn.execute(f"SELECT COUNT(*) FROM ({ids})", params).fetchone()[0]
+            copied = conn.execute(f"SELECT COUNT(*) FROM {schema}.{table} WHERE {key} IN ({ids})",
+                                  params).fetchone()[0]
+            if copied != source:
+                raise RuntimeError(f"Архив {path}: {table} скопировано {copied} из {source}, перенос отменен")
+
+        conn.execute(f"""
+            INSERT OR IGNORE INTO main.archived_hashes (content_hash)
+            SELECT content_hash FROM main.cars WHERE report_id IN ({report_ids}) AND content_hash IS NOT NULL
+        """, params)
+        photos = conn.execute(f"DELETE FROM main.photos WHERE report_id IN ({report_ids})", params).rowcount
+        cars = conn.execute(f"DELETE FROM main.cars WHERE report_id IN ({report_ids})", params).rowcount
+        reports = conn.execute("DELETE FROM main.reports WHERE date >= :date_from AND date < :date_to",
+                               params).rowcount
+        conn.execute("""
+            INSERT INTO archives (period, path, date_from, date_to, reports, cars, photos, archived_at)
+            VALUES (:period, :path, :date_from, :date_to, :reports, :cars, :photos, :now)
+            ON CONFLICT(period) DO UPDATE SET
+                reports = reports + excluded.reports,
+                cars = cars + excluded.cars,
+                photos = photos + excluded.photos,
+                archived_at = excluded.archived_at
+        """, {**params, "period": period, "path": path, "reports": reports, "cars": cars,
+              "photos": photos, "now": time.time()})
+        # Триггеры на удаление вычли машины месяца из сводок — считаем их заново,
+        # уже по архиву (он записан в archives и подключен выше)
+        rebuild_rollups(conn, start, end)
+    return reports, cars, photos
+
+def compact_db():
+    """Возвращает освободившиеся после архивации страницы и обновляет статистику планировщика.
+
+    Первый раз БД без auto_vacuum переводится в INCREMENTAL полным VACUUM,
+    дальше достаточно PRAGMA incremental_vacuum.
+    """
+    conn = get_connection()
+    detach_archives(conn)
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        # execute() делает один шаг прагмы и освобождает одну страницу, executescript — все
+        conn.executescript("PRAGMA incremental_vacuum")
+    conn.execute("ANALYZE")
+    conn.commit()
+    # В режиме WAL файл БД укорачивается только при checkpoint
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+# Запросы по отчетам, машинам и фото — шаблоны: {db} заменяется на main и
+# на схемы подключенных архивов, результаты склеиваются через UNION ALL.
+PHOTOS_SQL = """
+    SELECT photos.file_id FROM {db}.reports AS reports
+    JOIN {db}.photos AS photos ON photos.report_id = reports.id
+    WHERE reports.date >= :date_from AND reports.date < :date_to
+"""
+
+# Сводка читается только из daily_rollup/daily_plates, а не из cars,
+# поэтому время не зависит от числа машин за период.
+REPORT_SUMMARY_SQL = """
+    SELECT (SELECT COUNT(DISTINCT NULLIF(daily_plates.license_plate, ''))
+            FROM daily_plates
+            JOIN users ON daily_plates.user_id = users.id
+            WHERE daily_plates.date >= :date_from AND daily_plates.date < :date_to
+              AND (:tg_id IS NULL OR users.tg_id = :tg_id)),
+           SUM(daily_rollup.area),
+           SUM(daily_rollup.cost),
+           SUM(daily_rollup.labor_cost)
+    FROM daily_rollup
+    JOIN users ON daily_rollup.user_id = users.id
+    WHERE daily_rollup.date >= :date_from AND daily_rollup.date < :date_to
+      AND (:tg_id IS NULL OR users.tg_id = :tg_id)
+"""
+
+CAR_DETAILS_SQL = """
+    SELECT cars.license_plate, cars.description, cars.area, cars.cost, cars.labor_cost, reports.date, users.name,
+           users.id
+    FROM {db}.reports AS reports
+    JOIN {db}.cars AS cars ON cars.report_id = reports.id
+    JOIN users ON reports.user_id = users.id
+    WHERE reports.date >= :date_from AND reports.date < :date_to
+      AND (:tg_id IS NULL OR users.tg_id = :tg_id)
+"""
+
+def _get_photos(date_from, date_to):
     with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT file_id FROM photos 
-            JOIN reports ON photos.report_id = reports.id 
-            WHERE date(reports.date) = ?
-        """, (date,))
+        params = {"date_from": date_from, "date_to": date_to}
+        cur = conn.execute(_union(conn, PHOTOS_SQL, date_from, date_to), params)
         return [row[0] for row in cur.fetchall()]
 
+def get_photos_by_date(date):
+    return _get_photos(*day_range(date))
+
 def get_photos_by_month(year, month):
+    return _get_photos(*month_range(year, month))
+
+def get_report_summary(date_from: str, date_to: str, user_id=None):
     with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT file_id FROM photos 
-            JOIN reports ON photos.report_id = reports.id 
-            WHERE strftime('%Y', reports.date) = ? AND strftime('%m', reports.date) = ?
-        """, (str(year), f"{int(month):02d}"))
-        return [row[0] for row in cur.fetchall()]
+        start, end = day_range(date_from, date_to)
+        params = {"date_from": start, "date_to": end, "tg_id": user_id or None}
+        row = conn.execute(REPORT_SUMMARY_SQL, params).fetchone()
+        return row or (0, 0, 0, 0)
+
+def iter_car_details(date_from: str, date_to: str, user_id=None, batch_size=500):
+    """Строки детализации кортежами прямо из курсора, без материализации списка.
+
+    (номер, описание, площадь, материалы, работы, дата, имя, id сотрудника) по дате.
+    """
+    conn = get_connection()
+    start, end = day_range(date_from, date_to)
+    params = {"date_from": start, "date_to": end, "tg_id": user_id or None}
+    # ORDER BY по номеру столбца (reports.date) работает и для UNION ALL
+    cur = conn.execute(_union(conn, CAR_DETAILS_SQL, start, end) + " ORDER BY 6", params)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+SUBTOTALS_SQL = """
+    SELECT {key}, SUM(totals.cars_count), IFNULL(plates.plates, 0),
+           SUM(totals.area), SUM(totals.cost), SUM(totals.labor_cost)
+    FROM daily_rollup AS totals
+    JOIN users ON totals.user_id = users.id
+    LEFT JOIN (
+        SELECT {plates_key} AS group_key, COUNT(DISTINCT NULLIF(daily_plates.license_plate, '')) AS plates
+        FROM daily_plates
+        JOIN users ON daily_plates.user_id = users.id
+        WHERE daily_plates.date >= :date_from AND daily_plates.date < :date_to
+          AND (:tg_id IS NULL OR users.tg_id = :tg_id)
+        GROUP BY group_key
+    ) AS plates ON plates.group_key = {group_key}
+    WHERE totals.date >= :date_from AND totals.date < :date_to
+      AND (:tg_id IS NULL OR users.tg_id = :tg_id)
+    GROUP BY {group_key}
+    ORDER BY {order}
+"""
+
+DAILY_SUBTOTALS_SQL = SUBTOTALS_SQL.format(
+    key="totals.date", plates_key="daily_plates.date", group_key="totals.date", order="totals.date"
+)
+
+def get_daily_subtotals(date_from: str, date_to: str, user_id=None):
+    """[(дата, машин, уникальных номеров, площадь, материалы, работы)] по дням."""
+    start, end = day_range(date_from, date_to)
+    params = {"date_from": start, "date_to": end, "tg_id": user_id or None}
+    return get_connection().execute(DAILY_SUBTOTALS_SQL, params).fetchall()
+
+REPORT_STAMP_SQL = """
+    SELECT users.id AS user_id, users.name AS name, COUNT(*) AS reports, MAX(reports.id) AS last_id,
+           SUM(IFNULL(reports.catalog_version, 0)) AS versions
+    FROM {db}.reports AS reports
+    JOIN users ON reports.user_id = users.id
+    WHERE reports.date >= :date_from AND reports.date < :date_to
+      AND (:tg_id IS NULL OR users.tg_id = :tg_id)
+    GROUP BY users.id
+"""
+
+def get_report_stamp(date_from: str, date_to: str, user_id=None):
+    """[(id сотрудника, имя, отчетов, последний id отчета, сумма версий прайса)] за период.
+
+    Читает только reports по индексу на дату: дешевая метка того, что в
+    периоде появился отчет, сменилось имя сотрудника или прошел пересчет.
+    """
+    conn = get_connection()
+    start, end = day_range(date_from, date_to)
+    params = {"date_from": start, "date_to": end, "tg_id": user_id or None}
+    return conn.execute(f"""
+        SELECT user_id, name, SUM(reports), MAX(last_id), SUM(versions)
+        FROM ({_union(conn, REPORT_STAMP_SQL, start, end)})
+        GROUP BY user_id ORDER BY user_id
+    """, params).fetchall()
+
+# Запросы по периоду, которые не должны превращаться в полный просмотр таблиц
+PLAN_CHECKED_QUERIES = {
+    "photos": (PHOTOS_SQL.format(db="main"), {"date_from": "2000-01-01", "date_to": "2000-02-01"}),
+    "report_summary": (REPORT_SUMMARY_SQL, {"date_from": "2000-01-01", "date_to": "2000-02-01", "tg_id": None}),
+    "car_details": (CAR_DETAILS_SQL.format(db="main"), {"date_from": "2000-01-01", "date_to": "2000-02-01", "tg_id": None}),
+    "daily_subtotals": (DAILY_SUBTOTALS_SQL, {"date_from": "2000-01-01", "date_to": "2000-02-01", "tg_id": None}),
+    "report_stamp": (REPORT_STAMP_SQL.format(db="main"), {"date_from": "2000-01-01", "date_to": "2000-02-01", "tg_id": None}),
+}
+
+def check_query_plans(queries=None):
+    """Возвращает [(имя запроса, строка плана)] для каждого полного SCAN таблицы."""
+    problems = []
+    conn = get_connection()
+    for name, (query, params) in (queries or PLAN_CHECKED_QUERIES).items():
+        for row in conn.execute("EXPLAIN QUERY PLAN " + query, params):
+            detail = row[-1]
+            if detail.startswith("SCAN") and "USING" not in detail:
+                problems.append((name, detail))
+    return problems
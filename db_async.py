@@ -0,0 +1,99 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+# Запросы к SQLite выполняются в отдельных потоках, чтобы медленный отчет
+# не блокировал event loop и обработку сообщений других пользователей.
+# Пулы раздельные: файлы кэша фото и долгие выгрузки не занимают потоки,
+# которые нужны коротким запросам при приеме отчетов.
+IO_POOL_SIZE = 4  # чтение и запись файлов кэша фото, архивов
+EXPORT_POOL_SIZE = 2  # проход по периоду и запись Excel, пересчет по прайсу
+
+_executors = {}
+
+
+def get_executor(name="db"):
+    executor = _executors.get(name)
+    if executor is None:
+        size = {"db": db.DB_POOL_SIZE, "io": IO_POOL_SIZE, "export": EXPORT_POOL_SIZE}[name]
+        executor = _executors[name] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=name)
+    return executor
+
+
+async def _run(name, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(name), functools.partial(func, *args, **kwargs))
+
+
+async def run_db(func, *args, **kwargs):
+    """Короткий запрос к SQLite."""
+    return await _run("db", func, *args, **kwargs)
+
+
+async def run_io(func, *args, **kwargs):
+    """Блокирующая работа с файлами."""
+    return await _run("io", func, *args, **kwargs)
+
+
+async def run_export(func, *args, **kwargs):
+    """Долгая блокирующая сборка выгрузки: может читать БД минутами."""
+    return await _run("export", func, *args, **kwargs)
+
+
+def _wrap(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+
+def shutdown():
+    for executor in _executors.values():
+        executor.shutdown(wait=True)
+    _executors.clear()
+    db.close_connections()
+
+
+init_db = _wrap(db.init_db)
+check_query_plans = _wrap(db.check_query_plans)
+add_user = _wrap(db.add_user)
+resolve_user = _wrap(db.resolve_user)
+set_admin = _wrap(db.set_admin)
+is_admin = _wrap(db.is_admin)
+get_user_id = _wrap(db.get_user_id)
+add_report = _wrap(db.add_report)
+add_car = _wrap(db.add_car)
+add_photo = _wrap(db.add_photo)
+ingest_report = _wrap(db.ingest_report)
+buffer_photos = _wrap(db.buffer_photos)
+get_fsm_record = _wrap(db.get_fsm_record)
+set_fsm_state = _wrap(db.set_fsm_state)
+set_fsm_data = _wrap(db.set_fsm_data)
+update_fsm_data = _wrap(db.update_fsm_data)
+register_catalog_version = _wrap(db.register_catalog_version)
+record_unknown_services = _wrap(db.record_unknown_services)
+get_top_unknown_services = _wrap(db.get_top_unknown_services)
+delete_unknown_service = _wrap(db.delete_unknown_service)
+is_update_processed = _wrap(db.is_update_processed)
+mark_update_processed = _wrap(db.mark_update_processed)
+prune_processed_updates = _wrap(db.prune_processed_updates)
+enqueue_export = _wrap(db.enqueue_export)
+claim_export_job = _wrap(db.claim_export_job)
+touch_export_job = _wrap(db.touch_export_job)
+finish_export_job = _wrap(db.finish_export_job)
+release_export_job = _wrap(db.release_export_job)
+cancel_export = _wrap(db.cancel_export)
+get_export_job = _wrap(db.get_export_job)
+get_export_subscribers = _wrap(db.get_export_subscribers)
+count_active_exports = _wrap(db.count_active_exports)
+get_export_artifact = _wrap(db.get_export_artifact)
+save_export_artifact = _wrap(db.save_export_artifact)
+delete_export_artifact = _wrap(db.delete_export_artifact)
+prune_export_jobs = _wrap(db.prune_export_jobs)
+get_photos_by_date = _wrap(db.get_photos_by_date)
+get_photos_by_month = _wrap(db.get_photos_by_month)
+get_report_summary = _wrap(db.get_report_summary)
+get_daily_subtotals = _wrap(db.get_daily_subtotals)
+get_report_stamp = _wrap(db.get_report_stamp)
@@ -0,0 +1,95 @@
+import os
+import time
+
+from openpyxl import Workbook
+from openpyxl.cell import Cell
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
+from openpyxl.utils import get_column_letter
+
+from db import get_item_consumption
+from metrics import EXPORT_SECONDS, EXPORT_BYTES
+from period_report import PeriodReport
+
+DETAIL_HEADERS = ["№", "Номер", "Описание", "Площадь (м²)", "Материалы (руб)", "Работы (руб)", "Дата", "Исполнитель"]
+EMPLOYEE_HEADERS = ["Исполнитель", "Машин", "Уникальных номеров", "Площадь (м²)", "Материалы (руб)", "Работы (руб)"]
+CONSUMPTION_HEADERS = ["Позиция прайса", "Количество", "Площадь (м²)", "Работы (руб)"]
+DAILY_HEADERS = ["Дата", "Машин", "Уникальных номеров", "Площадь (м²)", "Материалы (руб)", "Работы (руб)"]
+
+
+def _styles(wb):
+    border_side = Side(style="thin", color="000000")
+    border = Border(left=border_side, right=border_side, top=border_side, bottom=border_side)
+    styles = [
+        NamedStyle(
+            name="header", font=Font(bold=True), border=border,
+            fill=PatternFill(start_color="FFD700", end_color="FFD700", fill_type="solid"),
+            alignment=Alignment(horizontal="center", vertical="center"),
+        ),
+        NamedStyle(name="text", border=border),
+        NamedStyle(name="area", border=border, number_format="0.00"),
+        NamedStyle(name="money", border=border, number_format="#,##0"),
+        NamedStyle(name="total", border=border, font=Font(bold=True), number_format="#,##0.##"),
+    ]
+    # Именованные стили регистрируются один раз; ячейки получают готовый
+    # массив стиля, без поиска стиля по имени на каждую ячейку
+    for style in styles:
+        wb.add_named_style(style)
+    return {style.name: style.as_tuple() for style in styles}
+
+
+def _row(ws, values, styles):
+    ws.append([Cell(ws, row=1, column=1, value=value, style_array=style) for value, style in zip(values, styles)])
+
+
+def _sheet(wb, styles, title, headers, widths):
+    ws = wb.create_sheet(title)
+    for col, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+    _row(ws, headers, [styles["header"]] * len(headers))
+    return ws
+
+
+def _subtotals_sheet(wb, styles, title, headers, rows, summary):
+    ws = _sheet(wb, styles, title, headers, [15, 10, 20, 15, 18, 15])
+    data_styles = [styles[name] for name in ("text", "money", "money", "area", "money", "money")]
+    for key, cars, plates, area, cost, labor_cost in rows:
+        _row(ws, [key, cars, plates, round(area or 0, 2), int(cost or 0), int(labor_cost or 0)], data_styles)
+    plates, area, cost, labor_cost = summary
+    total_cars = sum(row[1] for row in rows)
+    _row(ws, ["Итого", total_cars, plates or 0, round(area or 0, 2), int(cost or 0), int(labor_cost or 0)],
+         [styles["total"]] * 6)
+
+
+def create_excel_report(date_from: str, date_to: str, path: str, user_id=None, report=None) -> int:
+    """Пишет Excel-отчет за период в файл path; возвращает число машин.
+
+    Лист детализации пишется в write-only режиме прямо по ходу прохода
+    PeriodReport, строки не копятся в памяти; итоговые листы строятся из
+    сумм, собранных тем же проходом. report — PeriodReport вызывающего
+    (например, с on_car для текста в чат). Функция блокирующая.
+    """
+    started = time.perf_counter()
+    if report is None:
+        report = PeriodReport(date_from, date_to, user_id)
+    wb = Workbook(write_only=True)
+    styles = _styles(wb)
+
+    ws = _sheet(wb, styles, "Детализация", DETAIL_HEADERS, [6, 12, 40, 15, 18, 15, 12, 20])
+    data_styles = [styles[name] for name in ("text", "text", "text", "area", "money", "money", "text", "text")]
+    for count, (plate, description, area, cost, labor_cost, date, name, _) in enumerate(report, 1):
+        _row(ws, [count, plate, description, round(area or 0, 2), int(cost or 0), int(labor_cost or 0),
+                  date, name], data_styles)
+
+    summary = report.summary
+    _subtotals_sheet(wb, styles, "По сотрудникам", EMPLOYEE_HEADERS, report.employee_subtotals(), summary)
+    _subtotals_sheet(wb, styles, "По дням", DAILY_HEADERS, report.daily_subtotals(), summary)
+
+    ws = _sheet(wb, styles, "Расход по позициям", CONSUMPTION_HEADERS, [30, 12, 15, 15])
+    data_styles = [styles[name] for name in ("text", "money", "area", "money")]
+    for key, qty, area, labor_cost in get_item_consumption(date_from, date_to, user_id):
+        _row(ws, [key, qty, round(area or 0, 2), int(labor_cost or 0)], data_styles)
+
+    wb.save(path)
+    EXPORT_SECONDS.observe(time.perf_counter() - started, "excel")
+    EXPORT_BYTES.observe(os.path.getsize(path), "excel")
+    return report.total.cars
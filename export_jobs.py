@@ -0,0 +1,344 @@
+"""Очередь тяжелых выгрузок администратора: отчет с Excel и архив фото за месяц.
+
+Хендлер только ставит выгрузку в очередь (таблица export_jobs) и сразу
+освобождается; собирают выгрузки EXPORT_CONCURRENCY воркеров. Одинаковые
+незаконченные запросы склеиваются в одну задачу, результат получают все
+подписавшиеся чаты. Ход выгрузки виден в редактируемом сообщении с кнопкой
+отмены, упавшая выгрузка повторяется до EXPORT_ATTEMPTS раз.
+
+Готовые файлы за закрытые периоды запоминаются по file_id Telegram: повторный
+запрос отдается сразу, без сборки и загрузки, пока не изменились данные периода.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import date
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup
+
+import config
+from db import day_range, month_range
+from db_async import (
+    enqueue_export, claim_export_job, touch_export_job, finish_export_job, release_export_job,
+    get_export_subscribers, get_export_artifact, save_export_artifact, delete_export_artifact,
+    count_active_exports, prune_export_jobs,
+    get_daily_subtotals, get_report_stamp, get_photos_by_month, run_export,
+)
+from outbound import split_text
+from period_report import PeriodReport
+
+EXPORT_CONCURRENCY = getattr(config, "EXPORT_CONCURRENCY", 2)  # выгрузок, собираемых одновременно
+EXPORT_ATTEMPTS = 3
+EXPORT_RETRY_DELAY = 30  # секунд до повтора, растет с каждой попыткой
+EXPORT_LEASE = 300  # выгрузку без отметки дольше этого забирает другой воркер (процесс упал)
+EXPORT_POLL_INTERVAL = 5  # как часто воркер проверяет очередь, если его не разбудили
+
+logger = logging.getLogger(__name__)
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportResult:
+    """Тексты и документы выгрузки; close() убирает временные файлы."""
+
+    def __init__(self, texts=(), documents=(), cleanup=None):
+        self.texts = list(texts)
+        self.documents = list(documents)  # [(InputFile, подпись)]
+        self._cleanup = cleanup
+
+    def close(self):
+        if self._cleanup:
+            self._cleanup()
+
+
+def export_params(**params):
+    """Параметры выгрузки в каноническом виде: по этой строке склеиваются одинаковые запросы."""
+    return json.dumps(params, sort_keys=True)
+
+
+def format_car(idx: int, car: tuple) -> str:
+    """Машина в тексте детализации; car — строка детализации PeriodReport."""
+    plate, description, area, cost, labor_cost, date, name, _ = car
+    return (
+        f"{idx}. {plate} — {description}\n"
+        f"    Площадь: {area:.2f} м² | Материалы: {int(cost)} ₽ | Работы: {int(labor_cost)} ₽"
+        + (f"\n    Исполнитель: {name}" if name else "")
+        + (f"\n    Дата: {date}" if date else "")
+    )
+
+
+def generate_cars_report(lines: list) -> str:
+    """Текст детализации из строк format_car."""
+    if not lines:
+        return "Нет данных по машинам за выбранный период."
+    return '\n'.join(["\nДетализация:"] + lines)
+
+
+def generate_employees_report(subtotals: list) -> str:
+    """Разбивка по сотрудникам; для одного сотрудника не нужна — она совпадает с итогом."""
+    if len(subtotals) < 2:
+        return ""
+    lines = ["\nПо сотрудникам:"]
+    for name, cars, _, area, cost, labor_cost in subtotals:
+        lines.append(f"👷 {name}: {cars} маш. | {area:.2f} м² | {int(cost)} ₽ | работы {int(labor_cost)} ₽")
+    return '\n'.join(lines) + '\n'
+
+
+async def _build_report(bot, params, progress):
+    import tempfile
+    from excel_export import create_excel_report
+    date_from, date_to = params["date_from"], params["date_to"]
+    # Один проход по детализации пишет лист Excel, текст для чата и итоги
+    lines = []
+    report = PeriodReport(date_from, date_to, on_car=lambda idx, car: lines.append(format_car(idx, car)))
+    await progress("⏳ Собираю отчет…")
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await run_export(create_excel_report, date_from, date_to, path, report=report)
+    except BaseException:
+        os.remove(path)
+        raise
+    count, area, cost, labor_cost = report.summary
+    text = (
+        f"📊 Отчет с {date_from} по {date_to}\n"
+        f"🚗 Машин оклеено: {count or 0}\n"
+        f"📏 Площадь пленки (м²): {round(area or 0, 2)}\n"
+        f"💰 Стоимость материалов (руб): {int(cost or 0)}\n"
+        f"🔧 Общая стоимость работ (руб): {int(labor_cost or 0)}\n"
+    ) + generate_employees_report(report.employee_subtotals()) + generate_cars_report(lines)
+    if not lines:
+        os.remove(path)
+        return ExportResult([text])
+    document = FSInputFile(path, filename=f"report_{date_from}_to_{date_to}.xlsx")
+    return ExportResult([text], [(document, "📊 Ваш Excel-отчет по машинам")], lambda: os.remove(path))
+
+
+async def _report_fingerprint(params):
+    date_from, date_to = params["date_from"], params["date_to"]
+    # Только сводки и строки reports: правка машины задним числом меняет
+    # суммы дня, новый или присланный повторно отчет — число и id отчетов
+    return [await get_daily_subtotals(date_from, date_to), await get_report_stamp(date_from, date_to)]
+
+
+async def _build_photos(bot, params, progress):
+    from photo_export import build_photo_archives
+    year, month = map(int, params["month"].split("-"))
+    photos = await get_photos_by_month(year, month)
+    if not photos:
+        return ExportResult(["Нет фото за этот месяц."])
+
+    async def report(done, total):
+        await progress(f"⏳ Загружаю фото: {done}/{total}")
+
+    parts = await build_photo_archives(bot, photos, f"photos_{year}_{month:02d}", report)
+    documents = []
+    for n, part in enumerate(parts, 1):
+        caption = f"Архив фотографий за {params['month']} ({len(photos)} шт.)"
+        if len(parts) > 1:
+            caption += f"\nЧасть {n} из {len(parts)}: {part.count} шт."
+        documents.append((part.input_file, caption))
+    return ExportResult([], documents, lambda: [part.close() for part in parts])
+
+
+async def _photos_fingerprint(params):
+    return await get_photos_by_month(*map(int, params["month"].split("-")))
+
+
+def _period_end(params):
+    """Первый день после периода выгрузки."""
+    if "month" in params:
+        return month_range(*params["month"].split("-"))[1]
+    return day_range(params["date_from"], params["date_to"])[1]
+
+
+# kind -> (сборка, данные, от которых зависит результат)
+EXPORT_KINDS = {
+    "report": (_build_report, _report_fingerprint),
+    "photos": (_build_photos, _photos_fingerprint),
+}
+
+
+def _keyboard(action, job_id):
+    text = "Отменить" if action == "cancel" else "Повторить"
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=f"export:{action}:{job_id}")]
+    ])
+
+
+class ExportQueue:
+    def __init__(self, concurrency=EXPORT_CONCURRENCY):
+        self.concurrency = concurrency
+        self.bot = None
+        self._wakeups = []  # у каждого воркера свой сигнал: сбрасывает его только он сам
+        self._workers = []
+        self._running = {}  # job_id -> задача, собирающая выгрузку в этом процессе
+
+    def start(self, bot):
+        self.bot = bot
+        self._wakeups = [asyncio.Event() for _ in range(self.concurrency)]
+        self._workers = [asyncio.create_task(self._worker(wakeup)) for wakeup in self._wakeups]
+        self._workers.append(asyncio.create_task(self.prune()))
+
+    async def stop(self):
+        """Останавливает воркеры; недособранные выгрузки возвращаются в очередь."""
+        tasks = self._workers + list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+
+    async def join(self, interval=0.05):
+        """Ждет, пока в очереди не останется незаконченных выгрузок."""
+        while await count_active_exports():
+            await asyncio.sleep(interval)
+
+    async def _fingerprint(self, kind, params):
+        """Отпечаток данных закрытого периода или None, если период еще идет."""
+        if _period_end(params) > date.today().isoformat():
+            return None
+        data = await EXPORT_KINDS[kind][1](params)
+        return hashlib.sha1(json.dumps(data, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    async def submit(self, bot, kind, params, chat_id):
+        """Отдает готовую выгрузку из кэша или ставит ее в очередь; возвращает job_id или None."""
+        params = export_params(**params)
+        fingerprint = await self._fingerprint(kind, json.loads(params))
+        if fingerprint is not None:
+            cached = await get_export_artifact(kind, params, fingerprint)
+            if cached is not None:
+                texts, documents = cached
+                try:
+                    await self._send(bot, chat_id, texts, [(file_id, caption) for file_id, caption in documents])
+                    return None
+                except TelegramBadRequest as e:
+                    # file_id устарел или недоступен этому боту — собираем заново
+                    logger.warning("cached export failed kind=%s params=%s error=%s", kind, params, e)
+                    await delete_export_artifact(kind, params)
+
+        status = await bot.send_message(chat_id, "⏳ Выгрузка в очереди…")
+        job_id, created = await enqueue_export(kind, params, chat_id, status.message_id)
+        text = "⏳ Выгрузка в очереди…" if created else "⏳ Такая выгрузка уже готовится, пришлю, как будет готова."
+        await self._edit(bot, chat_id, status.message_id, text, _keyboard("cancel", job_id))
+        for wakeup in self._wakeups:
+            wakeup.set()
+        return job_id
+
+    def cancel_local(self, job_id):
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+
+    async def _worker(self, wakeup):
+        while True:
+            wakeup.clear()
+            try:
+                job = await claim_export_job(EXPORT_LEASE)
+            except Exception:
+                logger.exception("export claim failed")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), EXPORT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._run(*job))
+            self._running[job[0]] = task
+            try:
+                await asyncio.wait([task])
+            finally:
+                self._running.pop(job[0], None)
+
+    async def _run(self, job_id, kind, params, attempts):
+        build = EXPORT_KINDS[kind][0]
+
+        async def progress(text):
+            # Отметка заодно проверяет, не отменили ли выгрузку из другого процесса
+            if not await touch_export_job(job_id):
+                raise ExportCancelled()
+            await self._set_status(job_id, text, _keyboard("cancel", job_id))
+
+        logger.info("export started job_id=%s kind=%s params=%s attempt=%d", job_id, kind, params, attempts)
+        try:
+            fingerprint = await self._fingerprint(kind, json.loads(params))
+            await progress("⏳ Готовлю выгрузку…")
+            result = await build(self.bot, json.loads(params), progress)
+            try:
+                if not await touch_export_job(job_id):
+                    raise ExportCancelled()
+                documents = await self._deliver(job_id, result)
+            finally:
+                result.close()
+            if fingerprint is not None and len(documents) == len(result.documents):
+                await save_export_artifact(kind, params, fingerprint, result.texts, documents)
+            await finish_export_job(job_id, "done")
+            await self._set_status(job_id, "✅ Выгрузка готова.")
+        except ExportCancelled:
+            logger.info("export cancelled job_id=%s", job_id)
+        except asyncio.CancelledError:
+            # Отмена кнопкой уже записана в БД; при остановке бота выгрузка вернется в очередь
+            await asyncio.shield(release_export_job(job_id))
+            raise
+        except Exception as e:
+            logger.exception("export failed job_id=%s kind=%s attempt=%d", job_id, kind, attempts)
+            error = f"{type(e).__name__}: {e}"[:500]
+            if attempts < EXPORT_ATTEMPTS:
+                delay = EXPORT_RETRY_DELAY * attempts
+                await finish_export_job(job_id, "pending", error, retry_delay=delay)
+                await self._set_status(job_id, f"⚠️ Ошибка, повторю через {delay} с: {error}",
+                                       _keyboard("cancel", job_id))
+            else:
+                await finish_export_job(job_id, "failed", error)
+                await self._set_status(job_id, f"❌ Не удалось подготовить выгрузку: {error}",
+                                       _keyboard("retry", job_id))
+
+    async def _send(self, bot, chat_id, texts, documents):
+        """Отправляет тексты и документы; возвращает [(file_id, подпись)] документов."""
+        for text in texts:
+            for part in split_text(text):
+                await bot.send_message(chat_id, part)
+        sent = []
+        for document, caption in documents:
+            message = await bot.send_document(chat_id, document, caption=caption)
+            sent.append((message.document.file_id, caption))
+        return sent
+
+    async def _deliver(self, job_id, result):
+        """Рассылает результат подписчикам: файл загружается один раз, дальше уходит по file_id."""
+        documents = result.documents
+        file_ids = []
+        for chat_id, message_id in await get_export_subscribers(job_id):
+            try:
+                sent = await self._send(self.bot, chat_id, result.texts, documents)
+            except TelegramAPIError as e:
+                logger.warning("export delivery failed job_id=%s chat_id=%s error=%s", job_id, chat_id, e)
+                continue
+            if not file_ids:
+                file_ids = sent
+                documents = sent
+        return file_ids
+
+    async def _edit(self, bot, chat_id, message_id, text, keyboard=None):
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=keyboard)
+        except TelegramBadRequest:
+            pass  # текст не изменился или сообщение удалено
+
+    async def _set_status(self, job_id, text, keyboard=None):
+        for chat_id, message_id in await get_export_subscribers(job_id):
+            await self._edit(self.bot, chat_id, message_id, text, keyboard)
+
+    async def prune(self):
+        try:
+            await prune_export_jobs()
+        except Exception:
+            logger.exception("export jobs prune failed")
+
+
+export_queue = ExportQueue()
@@ -0,0 +1,34 @@
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+from db_async import get_fsm_record, set_fsm_state, set_fsm_data, update_fsm_data
+
+
+def _key(key: StorageKey):
+    return key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM aiogram в таблице fsm_states.
+
+    Состояние диалога переживает перезапуск и видно всем процессам бота,
+    работающим с одной БД.
+    """
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await set_fsm_state(_key(key), state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey):
+        return (await get_fsm_record(_key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        await set_fsm_data(_key(key), data)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return (await get_fsm_record(_key(key)))[1]
+
+    async def update_data(self, key: StorageKey, data: dict) -> dict:
+        return await update_fsm_data(_key(key), data)
+
+    async def close(self) -> None:
+        pass
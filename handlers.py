@@ -3,30 +3,42 @@ from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from aiogram.types.input_file import BufferedInputFile
-from datetime import datetime, timedelta
+from datetime import datetime
 import re
-import io
-from io import BytesIO
-from aiogram.types import InputFile
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-from openpyxl.utils import get_column_letter
-import zipfile
-import tempfile
-import os
+import calendar
+import json
 import asyncio
-import aiohttp
 
-from db import (
-    add_user, set_admin, is_admin, get_user_id,
-    add_report, add_car, add_photo, get_photos_by_date, get_connection, get_photos_by_month
+from db_async import (
+    set_admin,
+    ingest_report, buffer_photos, get_photos_by_date,
+    get_top_unknown_services, delete_unknown_service, run_db, run_io, run_export,
+    cancel_export, get_export_job,
 )
 from parser import parse_report_text
+from catalog import get_catalog, reload_catalog, add_alias, normalize
+from matcher import split_quantity
+from unknown_services import recorder as unknown_recorder
+from user_context import UserContext, user_cache
+# excel_export (openpyxl) и photo_export импортируются при первой выгрузке
+# или первом фото: процессу, который только принимает отчеты, они не нужны
+from photo_cache import PREFETCH as PREFETCH_PHOTOS, get_photo_cache
+from metrics import stats_text
+from albums import AlbumCollector
+from outbound import answer_long
+from repricing import reprice
+from export_jobs import export_queue
 from config import ADMIN_PASSWORD
 
 router = Router()
-photo_buffer = {}  # временное хранилище фото: {user_id: [file_id, ...]}
+background_tasks = set()  # ссылки на фоновые задачи, чтобы их не собрал GC
+
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 
 class AdminLogin(StatesGroup):
@@ -47,9 +59,8 @@ admin_keyboard = ReplyKeyboardMarkup(
 
 
 @router.message(CommandStart())
-async def cmd_start(message: types.Message):
-    add_user(message.from_user.id, message.from_user.full_name)
-    if is_admin(message.from_user.id):
+async def cmd_start(message: types.Message, user: UserContext):
+    if user.is_admin:
         await message.answer("Привет, админ! Отправь отчет или выбери действие:", reply_markup=admin_keyboard)
     else:
         await message.answer("Привет! Отправь отчет в свободной форме. Фото тоже можешь прислать отдельным сообщением.",
@@ -65,62 +76,193 @@ async def admin_login(message: types.Message, state: FSMContext):
 @router.message(AdminLogin.password)
 async def check_password(message: types.Message, state: FSMContext):
     if message.text == ADMIN_PASSWORD:
-        set_admin(message.from_user.id)
+        await set_admin(message.from_user.id)
+        user_cache.invalidate(message.from_user.id)
         await message.answer("✅ Администратор подтвержден.", reply_markup=admin_keyboard)
     else:
         await message.answer("❌ Неверный пароль.")
     await state.clear()
 
 
+@router.message(Command("reload_materials"))
+async def cmd_reload_materials(message: types.Message, user: UserContext):
+    if not user.is_admin:
+        return await message.answer("❌ Команда только для администратора.")
+    try:
+        catalog = await run_db(reload_catalog, force=True)
+        catalog_version = await run_db(lambda: catalog.version)
+    except Exception as e:
+        return await message.answer(f"⚠️ Не удалось загрузить materials.json: {e}")
+    await message.answer(
+        f"✅ Прайс перезагружен. Версия: {catalog_version}\n"
+        f"Элементов: {len(catalog.elements)}, работ: {len(catalog.labor)}"
+    )
+
+
+@router.message(Command("unknown"))
+async def cmd_unknown_services(message: types.Message, user: UserContext):
+    if not user.is_admin:
+        return await message.answer("❌ Команда только для администратора.")
+    parts = message.text.split()
+    limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10
+    await run_db(unknown_recorder.flush)
+    rows = await get_top_unknown_services(limit)
+    if not rows:
+        return await message.answer("Нераспознанных услуг нет.")
+
+    matcher = get_catalog().matcher
+    lines = [f"❓ Нераспознанные услуги (топ {len(rows)}):"]
+    for idx, (fragment, count, first_seen, last_seen, plates, reporters) in enumerate(rows, 1):
+        suggestions = matcher.suggest(fragment)
+        lines.append(
+            f"{idx}. «{fragment}» — {count} раз, {first_seen or '?'} … {last_seen or '?'}"
+            + (f"\n    Номера: {plates}" if plates else "")
+            + (f"\n    Сотрудники: {reporters}" if reporters else "")
+            + (f"\n    Похоже на: {', '.join(suggestions)}" if suggestions else "")
+        )
+    lines.append("\nДобавить в прайс: /add_alias фрагмент = ключ прайса "
+                 "(без «= ключ» берется первое похожее)")
+    await answer_long(message, "\n".join(lines))
+
+
+@router.message(Command("add_alias"))
+async def cmd_add_alias(message: types.Message, user: UserContext):
+    if not user.is_admin:
+        return await message.answer("❌ Команда только для администратора.")
+    _, _, args = message.text.partition(" ")
+    fragment, _, target = (s.strip() for s in args.partition("="))
+    if not fragment:
+        return await message.answer("Формат: /add_alias фрагмент = ключ прайса")
+    if not target:
+        suggestions = get_catalog().matcher.suggest(fragment)
+        if not suggestions:
+            return await message.answer(f"Не нашел похожих услуг для «{fragment}». Укажите ключ прайса явно.")
+        target = suggestions[0]
+    try:
+        catalog = await run_db(add_alias, fragment, target)
+        catalog_version = await run_db(lambda: catalog.version)
+    except KeyError:
+        return await message.answer(f"❌ В прайсе нет услуги «{target}».")
+    await delete_unknown_service(fragment)
+    # В прайс попадает фрагмент без количества и с ценой за одну штуку
+    alias = split_quantity(normalize(fragment))[1]
+    await message.answer(
+        f"✅ «{alias}» теперь считается как «{target}»: "
+        f"{catalog.elements.get(alias) or 0} м², работы {catalog.labor.get(alias) or 0} ₽ за штуку. "
+        f"Версия прайса: {catalog_version}"
+    )
+
+
+@router.message(Command("reprice"))
+async def cmd_reprice(message: types.Message, user: UserContext):
+    if not user.is_admin:
+        return await message.answer("❌ Команда только для администратора.")
+    args = message.text.split()[1:]
+    periods = [_parse_period(arg) for arg in args]
+    if len(args) == 1 and periods[0] and len(args[0]) == 7:
+        date_from, date_to = periods[0]
+    elif len(args) == 2 and all(period and len(arg) == 10 for arg, period in zip(args, periods)):
+        date_from, date_to = args
+    else:
+        return await message.answer("Формат: /reprice ГГГГ-ММ или /reprice ГГГГ-ММ-ДД ГГГГ-ММ-ДД")
+
+    status = await message.answer(f"⏳ Пересчитываю отчеты с {date_from} по {date_to} по текущему прайсу...")
+    try:
+        backfilled, items, cars = await run_export(reprice, date_from, date_to)
+    except Exception as e:
+        return await status.edit_text(f"⚠️ Не удалось пересчитать: {e}")
+    await status.edit_text(
+        f"✅ Отчеты с {date_from} по {date_to} пересчитаны.\n"
+        f"Позиций пересчитано: {items}, изменились итоги у {cars} машин"
+        + (f"\nОписания разобраны заново у {backfilled} машин" if backfilled else "")
+    )
+
+
+@router.message(Command("stats"))
+async def cmd_stats(message: types.Message, user: UserContext):
+    if not user.is_admin:
+        return await message.answer("❌ Команда только для администратора.")
+    cache = await run_io(lambda: get_photo_cache().stats())
+    await answer_long(
+        message,
+        stats_text()
+        + f"\nКэш фото: {cache['entries']} файлов, "
+          f"{cache['bytes'] / 1024 / 1024:.0f} из {cache['max_bytes'] / 1024 / 1024:.0f} МБ"
+    )
+
+
 @router.message(F.photo)
-async def handle_photo(message: types.Message):
-    user_id = message.from_user.id
+async def handle_photo(message: types.Message, bot: Bot, user: UserContext):
     file_id = message.photo[-1].file_id
+    if PREFETCH_PHOTOS:
+        from photo_export import prefetch_photo
+        run_in_background(prefetch_photo(bot, file_id))
+
+    if message.media_group_id:
+        # Фото альбома обрабатываются вместе, когда придет весь альбом
+        album_collector.add((message.chat.id, message.media_group_id), message, user)
+        return
+    await ingest_photos([message], user)
 
-    if message.caption:
-        try:
-            cars, date = parse_report_text(message.caption)
-            uid = get_user_id(user_id)
-            report_id = add_report(uid, date)
 
-            for car in cars:
-                add_car(report_id, car["plate"], car["description"], car["area"], car["cost"], car["labor_cost"])
+async def ingest_photos(messages: list, user: UserContext):
+    """Одно фото или целый альбом: один отчет (по подписи) или одно добавление в буфер."""
+    message = messages[0]
+    file_ids = [m.photo[-1].file_id for m in messages]
+    caption = next((m.caption for m in messages if m.caption), None)
 
-            add_photo(report_id, file_id)
+    if caption:
+        try:
+            catalog = get_catalog()
+            cars, date = parse_report_text(caption, catalog)
+            catalog_version = await run_db(lambda: catalog.version)
+            *_, duplicates = await ingest_report(user.id, date, cars, file_ids, catalog_version)
+            cars = _without(cars, duplicates)
+            unknown_recorder.record(cars, user.id)
 
             total_labor = sum(c['labor_cost'] for c in cars)
             await message.answer(
-                f"✅ Отчет с фото за {date} принят. Машин: {len(cars)}\n"
-                f"🔧 Общая стоимость работ: {total_labor} ₽",
-                reply_markup=admin_keyboard if is_admin(user_id) else ReplyKeyboardRemove()
+                f"✅ Отчет с фото за {date} принят. Машин: {len(cars)}, фото: {len(file_ids)}\n"
+                f"🔧 Общая стоимость работ: {total_labor} ₽"
+                + _duplicates_note(duplicates),
+                reply_markup=admin_keyboard if user.is_admin else ReplyKeyboardRemove()
             )
         except Exception as e:
             await message.answer(f"⚠️ Ошибка при обработке отчета с фото: {e}")
     else:
-        photo_buffer.setdefault(user_id, []).append(file_id)
-        await message.answer("📸 Фото получено. Пришли теперь текст отчета, чтобы связать с фото.")
+        waiting = await buffer_photos(user.tg_id, file_ids)
+        received = "📸 Фото получено." if len(file_ids) == 1 else f"📸 Получено фото: {len(file_ids)}."
+        if waiting > len(file_ids):
+            received += f" Всего ждут отчета: {waiting}."
+        await message.answer(f"{received} Пришли теперь текст отчета, чтобы связать с фото.")
+
+
+album_collector = AlbumCollector(ingest_photos)
 
 
 @router.message(F.text == "📸 Фото")
-async def photo_by_date_request(message: types.Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
+async def photo_by_date_request(message: types.Message, state: FSMContext, user: UserContext):
+    if not user.is_admin:
         return await message.answer("❌ Команда только для администратора.")
     await state.set_state(Form.waiting_for_photo_date)
     await message.answer("Введите дату или месяц для выгрузки фото (формат: ГГГГ-ММ-ДД или ГГГГ-ММ):")
 
 
 @router.message(Form.waiting_for_photo_date)
-async def handle_photo_by_date(message: types.Message, state: FSMContext, bot: Bot):
-    if not is_admin(message.from_user.id):
+async def handle_photo_by_date(message: types.Message, state: FSMContext, bot: Bot, user: UserContext):
+    if not user.is_admin:
         await message.answer("❌ Команда только для администратора.")
         await state.clear()
         return
 
-    date_input = message.text.strip()
-    
-    # Проверка формата даты (ГГГГ-ММ-ДД)
-    if re.match(r"^\d{4}-\d{2}-\d{2}$", date_input):
-        photos = get_photos_by_date(date_input)
+    date_input = (message.text or "").strip()
+    period = _parse_period(date_input)
+    await state.clear()
+    if period is None:
+        return await message.answer("❌ Неверная дата. Введите в формате ГГГГ-ММ-ДД или ГГГГ-ММ.")
+
+    if len(date_input) == 10:
+        photos = await get_photos_by_date(date_input)
         if not photos:
             await message.answer("Нет фото за эту дату.")
         else:
@@ -129,238 +271,106 @@ async def handle_photo_by_date(message: types.Message, state: FSMContext, bot: B
                 await message.answer_photo(media[0].media)
             else:
                 await message.answer_media_group(media)
-    # Проверка формата месяца (ГГГГ-ММ)
-    elif re.match(r"^\d{4}-\d{2}$", date_input):
-        year, month = map(int, date_input.split("-"))
-        photos = get_photos_by_month(year, month)
-        if not photos:
-            await message.answer("Нет фото за этот месяц.")
-        else:
-            # Создание архива фотографий
-            zip_buffer = io.BytesIO()
-            
-            async with aiohttp.ClientSession() as session:
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for i, file_id in enumerate(photos, 1):
-                        try:
-                            # Получение информации о файле
-                            file = await bot.get_file(file_id)
-                            file_path = file.file_path
-                            
-                            # Загрузка файла
-                            file_url = f"https://api.telegram.org/file/bot{bot.token}/{file_path}"
-                            async with session.get(file_url) as resp:
-                                if resp.status == 200:
-                                    file_content = await resp.read()
-                                    # Определяем расширение файла по file_path
-                                    ext = file_path.split('.')[-1] if '.' in file_path else 'jpg'
-                                    zip_file.writestr(f"photo_{i:03d}.{ext}", file_content)
-                                else:
-                                    # Если не удалось загрузить, добавляем текстовый файл с информацией
-                                    zip_file.writestr(f"photo_{i:03d}_{file_id}.txt", f"Фото с ID: {file_id}\nНе удалось загрузить файл. Статус: {resp.status}")
-                        except Exception as e:
-                            # Если произошла ошибка, добавляем текстовый файл с информацией
-                            zip_file.writestr(f"photo_{i:03d}_{file_id}.txt", f"Фото с ID: {file_id}\nОшибка при загрузке: {str(e)}")
-            
-            zip_buffer.seek(0)
-            input_file = BufferedInputFile(zip_buffer.read(), filename=f"photos_{year}_{month:02d}.zip")
-            await message.answer_document(input_file, caption=f"Архив фотографий за {date_input} ({len(photos)} шт.)")
     else:
-        await message.answer("❌ Неверный формат даты. Введите в формате ГГГГ-ММ-ДД или ГГГГ-ММ.")
-    
-    await state.clear()
+        # Архив за месяц собирается в очереди выгрузок, хендлер не ждет его
+        await export_queue.submit(bot, "photos", {"month": date_input}, message.chat.id)
 
 
 @router.message(F.text == "📊 Отчет")
-async def report_by_date_request(message: types.Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
+async def report_by_date_request(message: types.Message, state: FSMContext, user: UserContext):
+    if not user.is_admin:
         return await message.answer("❌ Команда только для администратора.")
     await state.set_state(Form.waiting_for_report_date)
     await message.answer("Введите дату или месяц для отчета (формат: ГГГГ-ММ или ГГГГ-ММ-ДД):")
 
 
 @router.message(Form.waiting_for_report_date)
-async def handle_report_by_date(message: types.Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
+async def handle_report_by_date(message: types.Message, state: FSMContext, bot: Bot, user: UserContext):
+    if not user.is_admin:
         await message.answer("❌ Команда только для администратора.")
         await state.clear()
         return
 
-    date_arg = message.text.strip()
-
-    if re.match(r"^\d{4}-\d{2}-\d{2}$", date_arg):
-        date_from = date_to = date_arg
-    elif re.match(r"^\d{4}-\d{2}$", date_arg):
-        year, month = map(int, date_arg.split("-"))
-        date_from = f"{year}-{month:02d}-01"
-        if month == 12:
-            date_to = f"{year + 1}-01-01"
-        else:
-            date_to = f"{year}-{month + 1:02d}-01"
-    else:
-        await message.answer("❌ Неверный формат даты.")
-        return
-
-    if date_to.endswith("-01"):
-        date_to_dt = datetime.strptime(date_to, "%Y-%m-%d") - timedelta(days=1)
-        date_to = date_to_dt.strftime("%Y-%m-%d")
-
-    count, area, cost, labor_cost = get_report_summary(date_from, date_to)
-    cars = get_car_details(date_from, date_to)
-
-    msg = (
-        f"📊 Отчет с {date_from} по {date_to}\n"
-        f"🚗 Машин оклеено: {count or 0}\n"
-        f"📏 Площадь пленки (м²): {round(area or 0, 2)}\n"
-        f"💰 Стоимость материалов (руб): {int(cost or 0)}\n"
-        f"🔧 Общая стоимость работ (руб): {int(labor_cost or 0)}\n"
-    )
-
-    details = generate_cars_report(cars)
-    full_msg = msg + details
-    if len(full_msg) < 3900:
-        await message.answer(full_msg)
-    else:
-        await message.answer(msg)
-        await message.answer(details[:3900])
-
-    if cars:
-        excel_stream = create_excel_report(cars, f"{date_from} — {date_to}")
-        excel_stream.seek(0)
-        await message.answer(f"Файл подготовлен, размер: {len(excel_stream.getvalue())} байт")  # отладка
-
-        file_bytes = excel_stream.read()
-        input_file = BufferedInputFile(file_bytes, filename=f"report_{date_from}_to_{date_to}.xlsx")
-        await message.answer_document(input_file, caption="📊 Ваш Excel-отчет по машинам")
-
+    period = _parse_period((message.text or "").strip())
     await state.clear()
+    if period is None:
+        return await message.answer("❌ Неверная дата. Введите в формате ГГГГ-ММ или ГГГГ-ММ-ДД.")
+
+    date_from, date_to = period
+    # Сводка, детализация и Excel собираются в очереди выгрузок
+    await export_queue.submit(bot, "report", {"date_from": date_from, "date_to": date_to}, message.chat.id)
+
+
+@router.callback_query(F.data.startswith("export:"))
+async def handle_export_button(callback: types.CallbackQuery, bot: Bot, user: UserContext):
+    if not user.is_admin:
+        return await callback.answer("❌ Только для администратора.", show_alert=True)
+    _, action, job_id = callback.data.split(":")
+    job_id = int(job_id)
+    if action == "cancel":
+        removed, cancelled = await cancel_export(job_id, callback.message.chat.id)
+        if cancelled:
+            export_queue.cancel_local(job_id)
+        await callback.message.edit_text("🚫 Выгрузка отменена." if removed else "Выгрузка уже завершена.")
+    elif action == "retry":
+        job = await get_export_job(job_id)
+        if job is None:
+            return await callback.answer("Выгрузка не найдена.", show_alert=True)
+        kind, params, _, _ = job
+        await callback.message.edit_reply_markup(reply_markup=None)
+        await export_queue.submit(bot, kind, json.loads(params), callback.message.chat.id)
+    await callback.answer()
 
 
 @router.message(F.text)
-async def handle_text_report(message: types.Message):
+async def handle_text_report(message: types.Message, user: UserContext):
     if message.text.startswith("/"):
         return
-    user_id = message.from_user.id
-    add_user(user_id, message.from_user.full_name)
-
     try:
-        cars, date = parse_report_text(message.text)
-        uid = get_user_id(user_id)
-        report_id = add_report(uid, date)
-
-        for car in cars:
-            add_car(report_id, car["plate"], car["description"], car["area"], car["cost"], car["labor_cost"])
-
-        if user_id in photo_buffer:
-            for file_id in photo_buffer[user_id]:
-                add_photo(report_id, file_id)
-            del photo_buffer[user_id]
+        catalog = get_catalog()
+        cars, date = parse_report_text(message.text, catalog)
+        catalog_version = await run_db(lambda: catalog.version)
+        # Фото из буфера забираются в той же транзакции, что и запись отчета
+        *_, duplicates = await ingest_report(user.id, date, cars, catalog_version=catalog_version,
+                                             buffer_tg_id=user.tg_id)
+        cars = _without(cars, duplicates)
+        unknown_recorder.record(cars, user.id)
 
         total_labor = sum(c['labor_cost'] for c in cars)
         await message.answer(
             f"✅ Отчет за {date} принят. Машин: {len(cars)}\n"
-            f"🔧 Общая стоимость работ: {total_labor} ₽",
-            reply_markup=admin_keyboard if is_admin(user_id) else ReplyKeyboardRemove()
+            f"🔧 Общая стоимость работ: {total_labor} ₽"
+            + _duplicates_note(duplicates),
+            reply_markup=admin_keyboard if user.is_admin else ReplyKeyboardRemove()
         )
     except Exception as e:
         await message.answer(f"⚠️ Ошибка при обработке отчета: {e}")
 
 
-# --- Вспомогательные функции для отчетов и Excel ---
-
-def get_report_summary(date_from: str, date_to: str, user_id=None):
-    with get_connection() as conn:
-        cur = conn.cursor()
-        query = """
-            SELECT COUNT(DISTINCT license_plate), 
-                   SUM(area), 
-                   SUM(cost),
-                   SUM(labor_cost)
-            FROM cars
-            JOIN reports ON cars.report_id = reports.id
-            JOIN users ON reports.user_id = users.id
-            WHERE date(reports.date) BETWEEN ? AND ?
-        """
-        params = [date_from, date_to]
-        if user_id:
-            query += " AND users.tg_id = ?"
-            params.append(user_id)
-        cur.execute(query, params)
-        row = cur.fetchone()
-        return row or (0, 0, 0, 0)
-
-
-def get_car_details(date_from: str, date_to: str, user_id=None):
-    with get_connection() as conn:
-        cur = conn.cursor()
-        query = """
-            SELECT cars.license_plate, cars.description, cars.area, cars.cost, cars.labor_cost, reports.date, users.name
-            FROM cars
-            JOIN reports ON cars.report_id = reports.id
-            JOIN users ON reports.user_id = users.id
-            WHERE date(reports.date) BETWEEN ? AND ?
-        """
-        params = [date_from, date_to]
-        if user_id:
-            query += " AND users.tg_id = ?"
-            params.append(user_id)
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        cols = [desc[0] for desc in cur.description]
-        return [dict(zip(cols, row)) for row in rows]
-
-
-def generate_cars_report(cars: list) -> str:
-    if not cars:
-        return "Нет данных по машинам за выбранный период."
-    lines = ["\nДетализация:"]
-    for idx, car in enumerate(cars, 1):
-        lines.append(
-            f"{idx}. {car['license_plate']} — {car['description']}\n"
-            f"    Площадь: {car['area']:.2f} м² | Материалы: {int(car['cost'])} ₽ | Работы: {int(car['labor_cost'])} ₽"
-            + (f"\n    Исполнитель: {car['name']}" if 'name' in car and car['name'] else "")
-            + (f"\n    Дата: {car['date']}" if 'date' in car and car['date'] else "")
-        )
-    return '\n'.join(lines)
-
-
-def create_excel_report(cars: list, date_range: str) -> io.BytesIO:
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Детализация"
-
-    bold_font = Font(bold=True)
-    header_fill = PatternFill(start_color="FFD700", end_color="FFD700", fill_type="solid")
-    border_side = Side(style="thin", color="000000")
-    border = Border(left=border_side, right=border_side, top=border_side, bottom=border_side)
-
-    headers = ["№", "Номер", "Описание", "Площадь (м²)", "Материалы (руб)", "Работы (руб)", "Дата", "Исполнитель"]
-    ws.append(headers)
-
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.font = bold_font
-        cell.fill = header_fill
-        cell.border = border
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-
-    for idx, car in enumerate(cars, 1):
-        row = [
-            idx,
-            car.get("license_plate", ""),
-            car.get("description", ""),
-            round(car.get("area", 0), 2),
-            int(car.get("cost", 0)),
-            int(car.get("labor_cost", 0)),
-            car.get("date", ""),
-            car.get("name", ""),
-        ]
-        ws.append(row)
-
-    for col in range(1, len(headers) + 1):
-        ws.column_dimensions[get_column_letter(col)].width = 15
-
-    stream = io.BytesIO()
-    wb.save(stream)
-    stream.seek(0)
-    return stream
+# --- Вспомогательные функции для отчетов ---
+
+def _parse_period(text: str):
+    """(первый, последний день) для "ГГГГ-ММ-ДД" или "ГГГГ-ММ"; None, если такой даты нет."""
+    try:
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", text):
+            day = datetime.strptime(text, "%Y-%m-%d").date().isoformat()
+            return day, day
+        if re.fullmatch(r"\d{4}-\d{2}", text):
+            first = datetime.strptime(text, "%Y-%m").date()
+            last = first.replace(day=calendar.monthrange(first.year, first.month)[1])
+            return first.isoformat(), last.isoformat()
+    except ValueError:
+        pass  # "2025-02-31", месяц 13
+    return None
+
+
+def _without(cars: list, duplicates: list) -> list:
+    skipped = {id(car) for car in duplicates}
+    return [car for car in cars if id(car) not in skipped]
+
+
+def _duplicates_note(duplicates: list) -> str:
+    if not duplicates:
+        return ""
+    plates = ", ".join(dict.fromkeys(car["plate"] for car in duplicates))
+    return f"\n♻️ Уже были записаны раньше, повторно не учтены ({len(duplicates)}): {plates}"
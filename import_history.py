@@ -0,0 +1,213 @@
+"""Импорт старых отчетов из выгрузки чата Telegram (result.json) или JSONL.
+
+    python import_history.py result.json
+    python import_history.py reports.jsonl --workers 4 --batch 1000
+
+Сообщения разбираются parse_report_text в пуле процессов и пишутся в БД
+пакетами по одной транзакции. После каждого пакета сохраняется контрольная
+точка (<файл>.checkpoint), поэтому прерванный импорт продолжается с места
+остановки, а повторный запуск не задваивает отчеты (reports.source).
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from catalog import get_catalog
+from db import init_db, ingest_reports, record_unknown_services, resolve_user
+from parser import parse_report_text
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def iter_telegram_export(path):
+    """Потоково читает массив messages из result.json, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buf = ""
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            buf += chunk
+            start = buf.find('"messages"')
+            bracket = buf.find("[", start) if start != -1 else -1
+            if bracket != -1:
+                break
+        chat_id = re.search(r'"id"\s*:\s*(-?\d+)', buf[:start])
+        chat_id = chat_id.group(1) if chat_id else os.path.basename(path)
+        buf = buf[bracket + 1:]
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buf):
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                buf, pos = chunk, 0
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                message, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    raise
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            pos = end
+            if pos > CHUNK_SIZE:
+                buf, pos = buf[pos:], 0
+            if message.get("type") != "message":
+                yield None
+                continue
+            text = message.get("text", "")
+            if isinstance(text, list):
+                text = "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+            from_id = str(message.get("from_id", ""))
+            yield {
+                "source": f"tg:{chat_id}:{message.get('id')}",
+                "text": text,
+                "date": (message.get("date") or "")[:10] or None,
+                "tg_id": int(from_id[4:]) if from_id.startswith("user") else None,
+                "name": message.get("from"),
+                "sent_at": _timestamp(message.get("date_unixtime") or message.get("date")),
+            }
+
+
+def _timestamp(value):
+    """Время сообщения в секундах Unix из числа или ISO-строки; None, если не разобрать."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_jsonl(path):
+    """Строки JSONL с полями text, date, tg_id/from_id, name/from, id (необязательно)."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                yield None
+                continue
+            record = json.loads(line)
+            text = record.get("text") or ""
+            tg_id = record.get("tg_id", record.get("from_id"))
+            if isinstance(tg_id, str):
+                tg_id = int(tg_id[4:]) if tg_id.startswith("user") else int(tg_id) if tg_id.isdigit() else None
+            record_id = record.get("id", record.get("message_id"))
+            if record_id is None:
+                # без id ключом служит содержимое записи
+                record_id = hashlib.sha1(
+                    json.dumps([text, record.get("date"), tg_id], ensure_ascii=False).encode("utf-8")
+                ).hexdigest()
+            yield {
+                "source": f"jsonl:{record_id}",
+                "text": text,
+                "date": (record.get("date") or "")[:10] or None,
+                "tg_id": tg_id,
+                "name": record.get("name", record.get("from")),
+                "sent_at": _timestamp(record.get("date")),
+            }
+
+
+def parse_message(message):
+    if not message or not message["text"].strip():
+        return None
+    cars, date = parse_report_text(message["text"], default_date=message["date"])
+    if not cars:
+        return None
+    return message, cars, date
+
+
+def read_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("offset", 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, offset):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"offset": offset}, f)
+    os.replace(tmp_path, path)
+
+
+def import_history(path, fmt="auto", batch_size=500, workers=None, resume=True):
+    if fmt == "auto":
+        fmt = "jsonl" if path.endswith(".jsonl") else "telegram"
+    messages = iter_jsonl(path) if fmt == "jsonl" else iter_telegram_export(path)
+    checkpoint = f"{path}.checkpoint"
+    offset = read_checkpoint(checkpoint) if resume else 0
+    for _ in range(offset):
+        if next(messages, StopIteration) is StopIteration:
+            break
+
+    init_db()
+    catalog_version = get_catalog().version
+    users = {}
+    imported = skipped = 0
+
+    def flush(batch, offset):
+        nonlocal imported, skipped
+        reports = []
+        for message, cars, date in batch:
+            tg_id = message["tg_id"]
+            if tg_id is not None and (tg_id not in users or users[tg_id][1] != message["name"]):
+                # Без времени сообщения имя только заполняет пустое, но не заменяет
+                user_id = resolve_user(tg_id, message["name"], message["sent_at"] or 0)[0]
+                users[tg_id] = (user_id, message["name"])
+            reports.append((users[tg_id][0] if tg_id is not None else None, date, cars, (),
+                            catalog_version, message["source"]))
+        results = ingest_reports(reports)
+        rows = []
+        for report, result in zip(reports, results):
+            if result is None or result[0] is None:
+                skipped += 1
+                continue
+            imported += 1
+            # Машины, уже записанные раньше (пересланные отчеты), не считаем повторно
+            duplicates = {id(car) for car in result[3]}
+            rows.extend((fragment, car["plate"], report[0], car["date"] or report[1])
+                        for car in report[2] if id(car) not in duplicates for fragment in car["unknown"])
+        record_unknown_services(rows)
+        write_checkpoint(checkpoint, offset)
+        print(f"Обработано сообщений: {offset}, загружено отчетов: {imported}, уже были: {skipped}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Пока пишется один пакет, пул уже разбирает следующий
+        window = list(islice(messages, batch_size))
+        results = pool.map(parse_message, window, chunksize=32)
+        while window:
+            next_window = list(islice(messages, batch_size))
+            next_results = pool.map(parse_message, next_window, chunksize=32) if next_window else None
+            offset += len(window)
+            flush([parsed for parsed in results if parsed is not None], offset)
+            window, results = next_window, next_results
+    return imported, skipped
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Импорт истории отчетов в carwrap.db")
+    arg_parser.add_argument("path", help="result.json из выгрузки Telegram или файл .jsonl")
+    arg_parser.add_argument("--format", choices=["auto", "telegram", "jsonl"], default="auto")
+    arg_parser.add_argument("--batch", type=int, default=500, help="отчетов в одной транзакции")
+    arg_parser.add_argument("--workers", type=int, default=None, help="процессов для разбора")
+    arg_parser.add_argument("--no-resume", action="store_true", help="начать заново, игнорируя checkpoint")
+    args = arg_parser.parse_args()
+
+    imported, skipped = import_history(args.path, args.format, args.batch, args.workers, not args.no_resume)
+    print(f"✅ Импорт завершен. Загружено отчетов: {imported}, пропущено повторов: {skipped}")
@@ -1,5 +0,0 @@
-from db import init_db
-
-if __name__ == "__main__":
-    init_db()
-    print("✅ База данных инициализирована")
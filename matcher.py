@@ -0,0 +1,254 @@
+import re
+import threading
+from collections import OrderedDict
+
+# Окончания, которые отбрасываются при сравнении слов: "двери" == "дверь",
+# "передних крыла" == "переднее крыло", "бампера" == "бампер".
+_ENDINGS = re.compile(
+    r"(ами|ями|ого|его|ому|ему|ыми|ими|ов|ев|ей|ий|ый|ой|ая|яя|ое|ее|ие|ые|их|ых|ом|ем|ам|ям|ах|ях|а|я|о|е|и|ы|у|ю|ь|й)$"
+)
+
+NUMBER_WORDS = {
+    "один": 1, "одна": 1, "одно": 1,
+    "два": 2, "две": 2, "оба": 2, "обе": 2,
+    "три": 3, "четыре": 4, "пять": 5, "шесть": 6,
+    "семь": 7, "восемь": 8, "девять": 9, "десять": 10,
+}
+
+CACHE_SIZE = 4096
+
+
+def stem(word):
+    if word.isdigit() or len(word) <= 3:
+        return word
+    stemmed = _ENDINGS.sub("", word)
+    return stemmed if len(stemmed) >= 3 else word
+
+
+def parse_quantity(word):
+    if word.isdigit():
+        return int(word)
+    return NUMBER_WORDS.get(word)
+
+
+def split_quantity(fragment):
+    """(количество, остаток) для фрагмента вида "10 элементов"; без числа — (1, фрагмент)."""
+    first, _, rest = fragment.partition(" ")
+    number = parse_quantity(first)
+    if number is not None and rest:
+        return number, rest
+    return 1, fragment
+
+
+def levenshtein(a, b, limit):
+    """Расстояние Левенштейна; при превышении limit возвращает limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        best = i
+        for j, cb in enumerate(b, 1):
+            val = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            cur.append(val)
+            if val < best:
+                best = val
+        if best > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+def max_distance(s):
+    # В коротких основах одна правка — уже другое слово: "крышк" и "крыш"
+    if len(s) < 6:
+        return 0
+    if len(s) <= 8:
+        return 1
+    return 2
+
+
+class BKTree:
+    def __init__(self, words):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            d = levenshtein(word, node[0], len(word) + len(node[0]))
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                return
+            node = child
+
+    def search(self, word, limit):
+        """Ближайшее слово в пределах limit правок или None."""
+        if self.root is None:
+            return None
+        best, best_d = None, limit + 1
+        stack = [self.root]
+        while stack:
+            candidate, children = stack.pop()
+            # для отсечения ветвей нужно точное расстояние, а не обрезанное
+            d = levenshtein(word, candidate, len(word) + len(candidate))
+            if d < best_d or (d == best_d and best is not None and candidate < best):
+                best, best_d = candidate, d
+            for dist, child in children.items():
+                if d - limit <= dist <= d + limit:
+                    stack.append(child)
+        return best if best_d <= limit else None
+
+    def nearest(self, word, limit, count):
+        """До count ближайших слов в пределах limit правок: [(расстояние, слово)]."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            candidate, children = stack.pop()
+            d = levenshtein(word, candidate, len(word) + len(candidate))
+            if d <= limit:
+                found.append((d, candidate))
+            for dist, child in children.items():
+                if d - limit <= dist <= d + limit:
+                    stack.append(child)
+        return sorted(found)[:count]
+
+
+class ServiceMatcher:
+    """Сопоставляет фрагменты описания с ключами прайса.
+
+    Строится один раз на версию прайса: пословный префиксный граф (trie)
+    по основам слов для поиска самых длинных совпадений внутри фрагмента
+    и BK-дерево для опечаток в пределах нескольких правок.
+    """
+
+    def __init__(self, elements, labor):
+        self.trie = {}
+        self.by_stem = {}
+        for key in list(elements) + [k for k in labor if k not in elements]:
+            stems = tuple(stem(w) for w in key.split())
+            if not stems:
+                continue
+            node = self.trie
+            for s in stems:
+                node = node.setdefault(s, {})
+            node.setdefault(None, key)
+            self.by_stem.setdefault(" ".join(stems), key)
+        self.bktree = BKTree(sorted(self.by_stem))
+        # Матчер общий для потоков пула БД: порядок LRU меняется под замком
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def match(self, fragment):
+        """Возвращает (items, unknown, fuzzy).
+
+        items — список (ключ прайса, количество), unknown — нераспознанный
+        фрагмент целиком (с количеством, если оно было указано: "10 элементов"),
+        fuzzy — сколько совпадений найдено по опечатке. Фрагмент распознается
+        только весь: если после совпадений остаются лишние слова ("половина
+        капота", "кай бампер"), он уходит в unknown без частичной цены.
+        """
+        with self._cache_lock:
+            cached = self._cache.get(fragment)
+            if cached is not None:
+                self._cache.move_to_end(fragment)
+                return cached
+        result = self._match(fragment)
+        with self._cache_lock:
+            self._cache[fragment] = result
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
+
+    def suggest(self, fragment, count=3):
+        """Похожие ключи прайса для нераспознанного фрагмента (с запасом по опечаткам)."""
+        # сначала ключи, найденные внутри фрагмента, затем близкие по написанию
+        found = [key for key, qty in self._scan(fragment.split())[0]]
+        _, fragment = split_quantity(fragment)
+        key = " ".join(stem(w) for w in fragment.split())
+        limit = max(2, len(key) // 3)
+        for d, word in self.bktree.nearest(key, limit, count):
+            if self.by_stem[word] not in found:
+                found.append(self.by_stem[word])
+        return found[:count]
+
+    def _longest(self, stems, start):
+        node = self.trie
+        found = None
+        for i in range(start, len(stems)):
+            node = node.get(stems[i])
+            if node is None:
+                break
+            if None in node:
+                found = (node[None], i + 1)
+        return found
+
+    def _fuzzy(self, words):
+        key = " ".join(stem(w) for w in words)
+        found = self.bktree.search(key, max_distance(key))
+        return self.by_stem[found] if found is not None else None
+
+    def _match(self, fragment):
+        items, leftover, fuzzy = self._scan(fragment.split())
+        if leftover or not items:
+            return [], [fragment], 0
+        return items, [], fuzzy
+
+    def _scan(self, words):
+        """Разбор слов слева направо: (items, нераспознанные слова, fuzzy).
+
+        Число перед ключом — его количество ("2 двери"), число в конце — количество
+        ключа перед ним ("бампер 2").
+        """
+        stems = [stem(w) for w in words]
+        items = []
+        leftover = []
+        fuzzy = 0
+        pending = []  # подряд идущие нераспознанные слова
+        qty = pending_qty = 1
+
+        def flush():
+            nonlocal fuzzy
+            if not pending:
+                return
+            key = self._fuzzy(pending)
+            if key is not None:
+                items.append((key, pending_qty))
+                fuzzy += 1
+            else:
+                leftover.extend(pending)
+            pending.clear()
+
+        i = 0
+        while i < len(words):
+            found = self._longest(stems, i)
+            if found is not None:
+                flush()
+                key, i = found
+                items.append((key, qty))
+                qty = 1
+                continue
+            number = parse_quantity(words[i])
+            if number is not None and i + 1 < len(words):
+                flush()
+                qty = number
+                i += 1
+                continue
+            if number is not None and not pending and items and items[-1][1] == 1 and qty == 1:
+                items[-1] = (items[-1][0], number)
+                i += 1
+                continue
+            if not pending:
+                pending_qty = qty
+                qty = 1
+            pending.append(words[i])
+            i += 1
+        flush()
+        return items, leftover, fuzzy
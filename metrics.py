@@ -0,0 +1,209 @@
+"""Метрики бота: счетчики и гистограммы в формате Prometheus.
+
+Модуль не зависит от aiogram, поэтому его можно импортировать из db и
+parser. Значения живут в памяти процесса; /metrics на локальном порту
+отдает их Prometheus, команда /stats — администратору в чат.
+"""
+import bisect
+import threading
+import time
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108  # 0 или None — не поднимать HTTP-эндпоинт
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTE_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2)
+
+STARTED_AT = time.time()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        if not amount:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def items(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [счетчики по корзинам, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def items(self):
+        """Список (метки, сумма, количество) — для /stats."""
+        with self._lock:
+            return sorted((labels, state[1], state[2]) for labels, state in self._values.items())
+
+    def quantile(self, q, *labels):
+        """Оценка квантиля сверху: граница корзины, в которую он попадает."""
+        with self._lock:
+            state = self._values.get(labels)
+            if not state or not state[2]:
+                return None
+            counts, _, total = state[0][:], state[1], state[2]
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((labels, state[0][:], state[1], state[2]) for labels, state in self._values.items())
+        for labels, counts, total_sum, total_count in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_number(total_sum)}")
+            lines.append(f"{self.name}_count{label_str} {total_count}")
+        return lines
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время обработки апдейта хендлером", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ["handler", "error"])
+DB_SECONDS = Histogram("bot_db_statement_seconds", "Время выполнения SQL-запроса", ["statement"])
+DB_SLOW = Counter("bot_db_slow_statements_total", "Медленные SQL-запросы", ["statement"])
+PARSED_CARS = Counter("bot_parsed_cars_total", "Разобрано машин")
+UNKNOWN_FRAGMENTS = Counter("bot_unknown_fragments_total", "Нераспознанные фрагменты описаний")
+FUZZY_MATCHES = Counter("bot_fuzzy_matches_total", "Услуги, найденные с опечаткой")
+EXPORT_SECONDS = Histogram("bot_export_seconds", "Длительность выгрузки", ["kind"])
+WEBHOOK_UPDATES = Counter("bot_webhook_updates_total", "Апдейты, пришедшие на webhook", ["result"])
+EXPORT_BYTES = Histogram("bot_export_bytes", "Размер выгрузки в байтах", ["kind"], buckets=BYTE_BUCKETS)
+
+REGISTRY = [HANDLER_SECONDS, HANDLER_ERRORS, DB_SECONDS, DB_SLOW, PARSED_CARS, UNKNOWN_FRAGMENTS,
+            FUZZY_MATCHES, EXPORT_SECONDS, EXPORT_BYTES, WEBHOOK_UPDATES]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class HandlerMetricsMiddleware:
+    """Внутренний middleware aiogram: время и ошибки каждого хендлера.
+
+    Регистрируется на событиях Dispatcher и наследуется вложенными роутерами.
+    """
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(1, name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.0f} мс" if seconds != float("inf") else "> 60 с"
+
+
+def stats_text(top=5):
+    """Сводка для команды /stats."""
+    uptime = int(time.time() - STARTED_AT)
+    lines = [f"📈 Статистика за {uptime // 3600} ч {uptime % 3600 // 60} мин", "", "Хендлеры:"]
+    for (name,), total, count in HANDLER_SECONDS.items():
+        errors = sum(value for (handler, _), value in HANDLER_ERRORS.items() if handler == name)
+        line = f"• {name}: {count} раз, среднее {_ms(total / count)}, p95 ≤ {_ms(HANDLER_SECONDS.quantile(0.95, name))}"
+        if errors:
+            line += f", ошибок {errors}"
+        lines.append(line)
+
+    statements = sorted(DB_SECONDS.items(), key=lambda item: item[1], reverse=True)
+    db_total = sum(total for _, total, _ in statements)
+    db_count = sum(count for _, _, count in statements)
+    slow = sum(value for _, value in DB_SLOW.items())
+    lines += ["", f"БД: {db_count} запросов, {db_total:.2f} с суммарно, медленных {slow}"]
+    for (statement,), total, count in statements[:top]:
+        lines.append(f"• {statement}: {count} раз, {total:.2f} с")
+
+    lines += [
+        "",
+        f"Разбор: машин {PARSED_CARS.value()}, нераспознанных фрагментов {UNKNOWN_FRAGMENTS.value()}, "
+        f"с опечаткой {FUZZY_MATCHES.value()}",
+    ]
+    sizes = {labels: (total, count) for labels, total, count in EXPORT_BYTES.items()}
+    for (kind,), total, count in EXPORT_SECONDS.items():
+        size = sizes.get((kind,), (0, 0))[0] / count / 1024 / 1024
+        lines.append(f"Выгрузка {kind}: {count} раз, среднее {total / count:.1f} с, {size:.1f} МБ")
+    return "\n".join(lines)
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Поднимает /metrics на локальном порту; возвращает runner для cleanup()."""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(body=render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,535 @@
+"""Миграции схемы БД по PRAGMA user_version.
+
+    python migrations.py    # применить недостающие миграции (то же делает бот при старте)
+
+Миграция с номером N — N-я функция в MIGRATIONS; user_version хранит номер
+последней примененной. Все недостающие миграции выполняются одной
+транзакцией вместе с записью нового user_version: при ошибке БД остается в
+прежней версии. Если схема уже последней версии, старт ограничивается
+чтением user_version.
+
+Новые миграции только дописываются в конец списка. Миграции 1–9 повторяют
+прежний models.sql и написаны так, чтобы их можно было применить к БД,
+созданной до появления версий (user_version 0 при любом наборе таблиц).
+"""
+import logging
+import sqlite3
+import time
+
+from db import ROLLUP_CARS_SQL, fill_rollups, insert_catalog_items
+from parser import content_hash
+
+logger = logging.getLogger(__name__)
+
+BASE_SCHEMA = """
+-- Пользователи (сотрудники и админы)
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tg_id INTEGER UNIQUE,
+    name TEXT,
+    is_admin BOOLEAN DEFAULT 0
+);
+
+-- Отчеты (один в день от сотрудника)
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    date TEXT,
+    FOREIGN KEY(user_id) REFERENCES users(id)
+);
+
+-- Автомобили в отчете (могут быть несколько)
+CREATE TABLE IF NOT EXISTS cars (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    report_id INTEGER,
+    license_plate TEXT,
+    description TEXT,
+    area REAL,
+    cost INTEGER,
+    labor_cost INTEGER DEFAULT 0,
+    FOREIGN KEY(report_id) REFERENCES reports(id)
+);
+
+-- Фото, привязанные к отчету
+CREATE TABLE IF NOT EXISTS photos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    report_id INTEGER,
+    file_id TEXT,
+    FOREIGN KEY(report_id) REFERENCES reports(id)
+);
+
+-- Таблица материалов (элементы и площадь)
+CREATE TABLE IF NOT EXISTS materials (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE,
+    area REAL,
+    active BOOLEAN DEFAULT 1
+);
+
+-- Индексы для выборок по периоду и связей между таблицами
+CREATE INDEX IF NOT EXISTS idx_reports_date ON reports(date);
+CREATE INDEX IF NOT EXISTS idx_reports_user_id ON reports(user_id);
+CREATE INDEX IF NOT EXISTS idx_cars_report_id ON cars(report_id);
+CREATE INDEX IF NOT EXISTS idx_photos_report_id ON photos(report_id);
+"""
+
+CATALOG_VERSIONS_SCHEMA = """
+-- Версии прайса materials.json, по которым считались отчеты
+CREATE TABLE IF NOT EXISTS catalog_versions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    digest TEXT UNIQUE,
+    content TEXT,
+    loaded_at TEXT,
+    price_per_m2 REAL
+);
+"""
+
+ROLLUP_SCHEMA = """
+-- Сводка по дням и сотрудникам для отчетов (ведется триггерами ниже).
+-- user_id = 0 — отчет без привязки к пользователю.
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    date TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    cars_count INTEGER NOT NULL DEFAULT 0,
+    area REAL NOT NULL DEFAULT 0,
+    cost INTEGER NOT NULL DEFAULT 0,
+    labor_cost INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, user_id)
+) WITHOUT ROWID;
+
+-- Номера машин по дням: нужны для COUNT(DISTINCT license_plate) за период
+CREATE TABLE IF NOT EXISTS daily_plates (
+    date TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    license_plate TEXT NOT NULL,
+    cars_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, user_id, license_plate)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_cars_rollup_insert AFTER INSERT ON cars
+BEGIN
+    INSERT INTO daily_rollup (date, user_id, cars_count, area, cost, labor_cost)
+    SELECT date, IFNULL(user_id, 0), 1, IFNULL(NEW.area, 0), IFNULL(NEW.cost, 0), IFNULL(NEW.labor_cost, 0)
+    FROM reports WHERE id = NEW.report_id AND date IS NOT NULL
+    ON CONFLICT(date, user_id) DO UPDATE SET
+        cars_count = cars_count + 1,
+        area = area + excluded.area,
+        cost = cost + excluded.cost,
+        labor_cost = labor_cost + excluded.labor_cost;
+    INSERT INTO daily_plates (date, user_id, license_plate, cars_count)
+    SELECT date, IFNULL(user_id, 0), IFNULL(NEW.license_plate, ''), 1
+    FROM reports WHERE id = NEW.report_id AND date IS NOT NULL
+    ON CONFLICT(date, user_id, license_plate) DO UPDATE SET cars_count = cars_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_cars_rollup_delete AFTER DELETE ON cars
+BEGIN
+    UPDATE daily_rollup SET
+        cars_count = cars_count - 1,
+        area = area - IFNULL(OLD.area, 0),
+        cost = cost - IFNULL(OLD.cost, 0),
+        labor_cost = labor_cost - IFNULL(OLD.labor_cost, 0)
+    WHERE (date, user_id) = (SELECT date, IFNULL(user_id, 0) FROM reports WHERE id = OLD.report_id);
+    DELETE FROM daily_rollup WHERE cars_count <= 0
+        AND (date, user_id) = (SELECT date, IFNULL(user_id, 0) FROM reports WHERE id = OLD.report_id);
+    UPDATE daily_plates SET cars_count = cars_count - 1
+    WHERE (date, user_id) = (SELECT date, IFNULL(user_id, 0) FROM reports WHERE id = OLD.report_id)
+        AND license_plate = IFNULL(OLD.license_plate, '');
+    DELETE FROM daily_plates WHERE cars_count <= 0
+        AND (date, user_id) = (SELECT date, IFNULL(user_id, 0) FROM reports WHERE id = OLD.report_id)
+        AND license_plate = IFNULL(OLD.license_plate, '');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_cars_rollup_update
+AFTER UPDATE OF report_id, license_plate, area, cost, labor_cost ON cars
+BEGIN
+    UPDATE daily_rollup SET
+        cars_count = cars_count - 1,
+        area = area - IFNULL(OLD.area, 0),
+        cost = cost - IFNULL(OLD.cost, 0),
+        labor_cost = labor_cost - IFNULL(OLD.labor_cost, 0)
+    WHERE (date, user_id) = (SELECT date, IFNULL(user_id, 0) FROM reports WHERE id = OLD.report_id);
+    UPDATE daily_plates SET cars_count = cars_count - 1
+    WHERE (date, user_id) = (SELECT date, IFNULL(user_id, 0) FROM reports WHERE id = OLD.report_id)
+        AND license_plate = IFNULL(OLD.license_plate, '');
+    INSERT INTO daily_rollup (date, user_id, cars_count, area, cost, labor_cost)
+    SELECT date, IFNULL(user_id, 0), 1, IFNULL(NEW.area, 0), IFNULL(NEW.cost, 0), IFNULL(NEW.labor_cost, 0)
+    FROM reports WHERE id = NEW.report_id AND date IS NOT NULL
+    ON CONFLICT(date, user_id) DO UPDATE SET
+        cars_count = cars_count + 1,
+        area = area + excluded.area,
+        cost = cost + excluded.cost,
+        labor_cost = labor_cost + excluded.labor_cost;
+    INSERT INTO daily_plates (date, user_id, license_plate, cars_count)
+    SELECT date, IFNULL(user_id, 0), IFNULL(NEW.license_plate, ''), 1
+    FROM reports WHERE id = NEW.report_id AND date IS NOT NULL
+    ON CONFLICT(date, user_id, license_plate) DO UPDATE SET cars_count = cars_count + 1;
+    DELETE FROM daily_rollup WHERE cars_count <= 0
+        AND (date, user_id) = (SELECT date, IFNULL(user_id, 0) FROM reports WHERE id = OLD.report_id);
+    DELETE FROM daily_plates WHERE cars_count <= 0
+        AND (date, user_id) = (SELECT date, IFNULL(user_id, 0) FROM reports WHERE id = OLD.report_id);
+END;
+
+-- Перенос машин отчета в сводке при смене даты или сотрудника, удаление отчета
+CREATE TRIGGER IF NOT EXISTS trg_reports_rollup_update AFTER UPDATE OF date, user_id ON reports
+WHEN OLD.date IS NOT NEW.date OR OLD.user_id IS NOT NEW.user_id
+BEGIN
+    UPDATE daily_rollup SET
+        cars_count = cars_count - (SELECT COUNT(*) FROM cars WHERE report_id = OLD.id),
+        area = area - (SELECT IFNULL(SUM(area), 0) FROM cars WHERE report_id = OLD.id),
+        cost = cost - (SELECT IFNULL(SUM(cost), 0) FROM cars WHERE report_id = OLD.id),
+        labor_cost = labor_cost - (SELECT IFNULL(SUM(labor_cost), 0) FROM cars WHERE report_id = OLD.id)
+    WHERE date = OLD.date AND user_id = IFNULL(OLD.user_id, 0);
+    UPDATE daily_plates SET cars_count = cars_count - (
+        SELECT COUNT(*) FROM cars
+        WHERE report_id = OLD.id AND IFNULL(cars.license_plate, '') = daily_plates.license_plate
+    )
+    WHERE date = OLD.date AND user_id = IFNULL(OLD.user_id, 0);
+    DELETE FROM daily_rollup WHERE cars_count <= 0 AND date = OLD.date AND user_id = IFNULL(OLD.user_id, 0);
+    DELETE FROM daily_plates WHERE cars_count <= 0 AND date = OLD.date AND user_id = IFNULL(OLD.user_id, 0);
+    INSERT INTO daily_rollup (date, user_id, cars_count, area, cost, labor_cost)
+    SELECT NEW.date, IFNULL(NEW.user_id, 0), COUNT(*), IFNULL(SUM(area), 0), IFNULL(SUM(cost), 0), IFNULL(SUM(labor_cost), 0)
+    FROM cars WHERE report_id = NEW.id AND NEW.date IS NOT NULL
+    GROUP BY report_id
+    ON CONFLICT(date, user_id) DO UPDATE SET
+        cars_count = cars_count + excluded.cars_count,
+        area = area + excluded.area,
+        cost = cost + excluded.cost,
+        labor_cost = labor_cost + excluded.labor_cost;
+    INSERT INTO daily_plates (date, user_id, license_plate, cars_count)
+    SELECT NEW.date, IFNULL(NEW.user_id, 0), IFNULL(license_plate, ''), COUNT(*)
+    FROM cars WHERE report_id = NEW.id AND NEW.date IS NOT NULL
+    GROUP BY IFNULL(license_plate, '')
+    ON CONFLICT(date, user_id, license_plate) DO UPDATE SET cars_count = cars_count + excluded.cars_count;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_reports_rollup_delete AFTER DELETE ON reports
+BEGIN
+    UPDATE daily_rollup SET
+        cars_count = cars_count - (SELECT COUNT(*) FROM cars WHERE report_id = OLD.id),
+        area = area - (SELECT IFNULL(SUM(area), 0) FROM cars WHERE report_id = OLD.id),
+        cost = cost - (SELECT IFNULL(SUM(cost), 0) FROM cars WHERE report_id = OLD.id),
+        labor_cost = labor_cost - (SELECT IFNULL(SUM(labor_cost), 0) FROM cars WHERE report_id = OLD.id)
+    WHERE date = OLD.date AND user_id = IFNULL(OLD.user_id, 0);
+    UPDATE daily_plates SET cars_count = cars_count - (
+        SELECT COUNT(*) FROM cars
+        WHERE report_id = OLD.id AND IFNULL(cars.license_plate, '') = daily_plates.license_plate
+    )
+    WHERE date = OLD.date AND user_id = IFNULL(OLD.user_id, 0);
+    DELETE FROM daily_rollup WHERE cars_count <= 0 AND date = OLD.date AND user_id = IFNULL(OLD.user_id, 0);
+    DELETE FROM daily_plates WHERE cars_count <= 0 AND date = OLD.date AND user_id = IFNULL(OLD.user_id, 0);
+END;
+"""
+
+UNKNOWN_SERVICES_SCHEMA = """
+-- Нераспознанные фрагменты описаний (вместо unrecognized_services.txt)
+CREATE TABLE IF NOT EXISTS unknown_services (
+    fragment TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0,
+    first_seen TEXT,
+    last_seen TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_unknown_services_count ON unknown_services(count);
+
+-- Где встречался фрагмент: номер машины и сотрудник (0 — неизвестен)
+CREATE TABLE IF NOT EXISTS unknown_service_sources (
+    fragment TEXT NOT NULL,
+    license_plate TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (fragment, license_plate, user_id)
+) WITHOUT ROWID;
+"""
+
+BOT_STATE_SCHEMA = """
+-- update_id уже принятых через webhook апдейтов: повторная доставка не обрабатывается
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id INTEGER PRIMARY KEY,
+    received_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_processed_updates_received_at ON processed_updates(received_at);
+
+-- Состояния FSM aiogram (диалоги админа), общие для всех процессов бота; thread_id 0 — без темы
+CREATE TABLE IF NOT EXISTS fsm_states (
+    bot_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    thread_id INTEGER NOT NULL,
+    destiny TEXT NOT NULL,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+) WITHOUT ROWID;
+
+-- Фото, присланные без подписи и ждущие текста отчета
+CREATE TABLE IF NOT EXISTS photo_buffer (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tg_id INTEGER NOT NULL,
+    file_id TEXT NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_photo_buffer_tg_id ON photo_buffer(tg_id);
+CREATE INDEX IF NOT EXISTS idx_photo_buffer_added_at ON photo_buffer(added_at);
+"""
+
+CAR_ITEMS_SCHEMA = """
+-- Позиции каждой версии прайса: площадь и стоимость работ за единицу
+CREATE TABLE IF NOT EXISTS catalog_items (
+    catalog_version INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    area REAL NOT NULL DEFAULT 0,
+    labor_cost REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (catalog_version, key),
+    FOREIGN KEY(catalog_version) REFERENCES catalog_versions(id)
+) WITHOUT ROWID;
+
+-- Распознанные услуги машины: позиция прайса, количество и посчитанные по версии прайса площадь и работы
+CREATE TABLE IF NOT EXISTS car_items (
+    car_id INTEGER NOT NULL,
+    catalog_key TEXT NOT NULL,
+    catalog_version INTEGER,
+    qty REAL NOT NULL,
+    area REAL NOT NULL,
+    labor_cost REAL NOT NULL,
+    PRIMARY KEY (car_id, catalog_key),
+    FOREIGN KEY(car_id) REFERENCES cars(id),
+    FOREIGN KEY(catalog_version) REFERENCES catalog_versions(id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_car_items_key ON car_items(catalog_key);
+
+CREATE TRIGGER IF NOT EXISTS trg_cars_items_delete
+AFTER DELETE ON cars
+BEGIN
+    DELETE FROM car_items WHERE car_id = OLD.id;
+END;
+"""
+
+ARCHIVES_SCHEMA = """
+-- Месяцы, перенесенные в файлы архива (archive.py); path — относительно файла БД.
+-- Сводки daily_rollup/daily_plates за эти месяцы остаются в основной БД.
+CREATE TABLE IF NOT EXISTS archives (
+    period TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    date_from TEXT NOT NULL,
+    date_to TEXT NOT NULL,
+    reports INTEGER NOT NULL DEFAULT 0,
+    cars INTEGER NOT NULL DEFAULT 0,
+    photos INTEGER NOT NULL DEFAULT 0,
+    archived_at REAL NOT NULL
+);
+
+-- Отпечатки машин, перенесенных в архив: проверка повторов видит их без ATTACH
+CREATE TABLE IF NOT EXISTS archived_hashes (
+    content_hash TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+
+EXPORT_JOBS_SCHEMA = """
+-- Очередь тяжелых выгрузок администратора (export_jobs.py)
+CREATE TABLE export_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    run_after REAL NOT NULL,
+    heartbeat_at REAL,
+    finished_at REAL
+);
+-- Одинаковая выгрузка не ставится в очередь второй раз, пока первая не закончена
+CREATE UNIQUE INDEX idx_export_jobs_active ON export_jobs(kind, params)
+    WHERE status IN ('pending', 'running');
+CREATE INDEX idx_export_jobs_status ON export_jobs(status, run_after);
+
+-- Кто ждет выгрузку и в каком сообщении показывается ее ход
+CREATE TABLE export_subscribers (
+    job_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (job_id, chat_id),
+    FOREIGN KEY(job_id) REFERENCES export_jobs(id)
+) WITHOUT ROWID;
+
+-- Готовые выгрузки за закрытые периоды: тексты и file_id отправленных документов.
+-- fingerprint — отпечаток данных периода, при его изменении выгрузка собирается заново.
+CREATE TABLE export_artifacts (
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    texts TEXT NOT NULL,
+    documents TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (kind, params)
+) WITHOUT ROWID;
+"""
+
+def execute_script(conn, script):
+    """Выполняет SQL-скрипт по одной инструкции в текущей транзакции.
+
+    sqlite3.executescript сначала делает COMMIT, поэтому для миграций не подходит.
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        if not statement and (not line.strip() or line.lstrip().startswith("--")):
+            continue
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+    if statement.strip():
+        raise ValueError(f"Незавершенная инструкция в конце скрипта: {statement[:80]}")
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _add_column(conn, table, column, decl):
+    """ALTER TABLE ADD COLUMN, если столбца еще нет; True — столбец добавлен."""
+    if column in _columns(conn, table):
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+
+def _table_exists(conn, table):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row is not None
+
+
+def _base_tables(conn):
+    execute_script(conn, BASE_SCHEMA)
+    # Даты отчетов храним строго как ГГГГ-ММ-ДД, чтобы фильтр по периоду
+    # был простым диапазоном по индексу idx_reports_date.
+    conn.execute("UPDATE reports SET date = date(date) WHERE date(date) IS NOT NULL AND date <> date(date)")
+
+
+def _catalog_versions(conn):
+    execute_script(conn, CATALOG_VERSIONS_SCHEMA)
+    _add_column(conn, "reports", "catalog_version", "INTEGER REFERENCES catalog_versions(id)")
+
+
+def _daily_rollups(conn):
+    fresh = not _table_exists(conn, "daily_rollup")
+    execute_script(conn, ROLLUP_SCHEMA)
+    if fresh:
+        fill_rollups(conn, ROLLUP_CARS_SQL.format(db="main"))
+
+
+def _unknown_services(conn):
+    execute_script(conn, UNKNOWN_SERVICES_SCHEMA)
+
+
+def _report_sources(conn):
+    # source — ключ исходного сообщения при импорте истории, защищает от повторной загрузки
+    _add_column(conn, "reports", "source", "TEXT")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_source ON reports(source) WHERE source IS NOT NULL")
+
+
+def _bot_state(conn):
+    execute_script(conn, BOT_STATE_SCHEMA)
+
+
+def _car_items(conn):
+    _add_column(conn, "catalog_versions", "price_per_m2", "REAL")
+    # Сколько фрагментов описания не нашлось в прайсе; NULL — описание в позиции
+    # не разбиралось. Такие машины пересчет разбирает заново (repricing.py).
+    _add_column(conn, "cars", "unknown_parts", "INTEGER")
+    execute_script(conn, CAR_ITEMS_SCHEMA)
+    # Позиции прайса для версий, загруженных до появления catalog_items
+    cur = conn.cursor()
+    for version_id, content in conn.execute(
+            "SELECT id, content FROM catalog_versions WHERE price_per_m2 IS NULL").fetchall():
+        insert_catalog_items(cur, version_id, content)
+
+
+def _content_hashes(conn):
+    if _add_column(conn, "cars", "content_hash", "TEXT"):
+        # Уже задвоенные в старых данных машины остаются без отпечатка: уникальный
+        # индекс получает только первая запись, историю при этом не трогаем.
+        seen = set()
+        rows = []
+        for car_id, user_id, date, plate, description in conn.execute("""
+            SELECT cars.id, reports.user_id, reports.date, cars.license_plate, cars.description
+            FROM cars JOIN reports ON cars.report_id = reports.id
+            ORDER BY cars.id
+        """):
+            digest = content_hash(user_id, date, plate, description)
+            if digest not in seen:
+                seen.add(digest)
+                rows.append((digest, car_id))
+        conn.executemany("UPDATE cars SET content_hash = ? WHERE id = ?", rows)
+    # Одна и та же машина в повторно присланном отчете не записывается второй раз
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_cars_content_hash ON cars(content_hash) "
+                 "WHERE content_hash IS NOT NULL")
+
+
+def _archives(conn):
+    execute_script(conn, ARCHIVES_SCHEMA)
+
+
+def _export_jobs(conn):
+    execute_script(conn, EXPORT_JOBS_SCHEMA)
+
+
+def _user_names(conn):
+    # Время сообщения, из которого взято имя: импорт старой истории не должен
+    # затирать имя, пришедшее позже. Имена из бота до миграции считаем свежими.
+    if _add_column(conn, "users", "name_seen_at", "REAL"):
+        conn.execute("UPDATE users SET name_seen_at = ? WHERE name IS NOT NULL", (time.time(),))
+
+
+MIGRATIONS = [
+    _base_tables,        # 1
+    _catalog_versions,   # 2
+    _daily_rollups,      # 3
+    _unknown_services,   # 4
+    _report_sources,     # 5
+    _bot_state,          # 6
+    _car_items,          # 7
+    _content_hashes,     # 8
+    _archives,           # 9
+    _export_jobs,        # 10
+    _user_names,         # 11
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Применяет недостающие миграции; возвращает номера примененных."""
+    target = len(migrations)
+    if schema_version(conn) == target:
+        return []
+    with conn:
+        # Блокировка записи сразу: два процесса, стартующие одновременно, не применят миграции дважды
+        conn.execute("BEGIN IMMEDIATE")
+        current = schema_version(conn)
+        if current > target:
+            raise RuntimeError(f"Схема БД версии {current} новее, чем знает код ({target})")
+        applied = list(range(current + 1, target + 1))
+        for number in applied:
+            logger.info("applying migration %d %s", number, migrations[number - 1].__name__.lstrip("_"))
+            migrations[number - 1](conn)
+        conn.execute(f"PRAGMA user_version = {target}")
+    return applied
+
+
+if __name__ == "__main__":
+    from db import get_connection, check_query_plans
+    from unknown_services import import_legacy_log
+
+    conn = get_connection()
+    applied = migrate(conn)
+    print(f"✅ Схема БД версии {schema_version(conn)}, применено миграций: {len(applied)}")
+    imported = import_legacy_log()
+    if imported:
+        print(f"📥 Из unrecognized_services.txt перенесено строк: {imported}. Файл можно удалить.")
+    for name, detail in check_query_plans():
+        print(f"⚠️ Запрос {name} читает таблицу целиком: {detail}")
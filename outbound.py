@@ -0,0 +1,163 @@
+"""Исходящие сообщения: темп отправки, повтор после RetryAfter и разбиение длинных текстов.
+
+OutboundRateLimiter ставится middleware на сессию бота и поэтому
+покрывает все вызовы Bot API — message.answer, answer_document,
+edit_text и остальные — без правок в хендлерах.
+"""
+import asyncio
+import logging
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+TEXT_LIMIT = 4096  # длина сообщения в Telegram, в единицах UTF-16
+GLOBAL_RATE = 30  # сообщений в секунду на бота
+CHAT_RATE = 1  # сообщений в секунду в личный чат
+GROUP_RATE = 20 / 60  # сообщений в секунду в группу
+CHAT_BURST = 3  # столько сообщений подряд в чат уходят без паузы
+SEND_RETRIES = 3
+MAX_CHAT_BUCKETS = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def _units(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _hard_split(text, limit):
+    # Строка без переносов длиннее лимита — режем по символам
+    parts = []
+    current = ""
+    for char in text:
+        if _units(current) + _units(char) > limit:
+            parts.append(current)
+            current = ""
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_text(text, limit=TEXT_LIMIT):
+    """Делит текст на сообщения не длиннее limit, не разрывая записи.
+
+    Запись — строка без отступа вместе со следующими за ней строками с
+    отступом (так generate_cars_report пишет машину и ее площадь, исполнителя,
+    дату). Запись длиннее лимита делится по строкам, строка — по символам.
+    """
+    entries = []
+    for line in text.split("\n"):
+        if entries and line[:1].isspace():
+            entries[-1] += "\n" + line
+        else:
+            entries.append(line)
+
+    parts = []
+    current = None
+    for entry in entries:
+        if _units(entry) > limit:
+            pieces = []
+            for line in entry.split("\n"):
+                pieces.extend(_hard_split(line, limit) if _units(line) > limit else [line])
+        else:
+            pieces = [entry]
+        for piece in pieces:
+            if current is not None and _units(current) + 1 + _units(piece) <= limit:
+                current += "\n" + piece
+            else:
+                if current is not None:
+                    parts.append(current)
+                current = piece
+    if current is not None:
+        parts.append(current)
+    return [part for part in parts if part.strip()] or [text]
+
+
+async def answer_long(message, text, **kwargs):
+    """message.answer для текста любой длины; клавиатура — только у последней части."""
+    parts = split_text(text)
+    reply_markup = kwargs.pop("reply_markup", None)
+    result = None
+    for i, part in enumerate(parts, 1):
+        result = await message.answer(part, reply_markup=reply_markup if i == len(parts) else None, **kwargs)
+    return result
+
+
+class TokenBucket:
+    """Корзина токенов с резервированием: reserve() сразу списывает токен
+    и возвращает, сколько секунд подождать до его появления."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds):
+        """Не выдавать токены ближайшие seconds секунд (после RetryAfter)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """Темп отправки по общему и по-чатовому лимитам Telegram и повтор после RetryAfter.
+
+    Лимит применяется к методам с chat_id (отправка и редактирование
+    сообщений). Токены резервируются в порядке вызова, поэтому сообщения в
+    один чат уходят в том же порядке, в каком их отправляли хендлеры.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, group_rate=GROUP_RATE,
+                 burst=CHAT_BURST, retries=SEND_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.retries = retries
+        self.chats = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= MAX_CHAT_BUCKETS:
+                # Полные корзины ничего не помнят — их можно выбросить
+                self.chats = {key: value for key, value in self.chats.items() if not value.idle()}
+            # У групп и каналов chat_id отрицательный или это @username
+            private = isinstance(chat_id, int) and chat_id > 0
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate if private else self.group_rate, self.burst)
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        for attempt in range(self.retries + 1):
+            if chat_id is not None:
+                delay = max(self.global_bucket.reserve(), self._chat_bucket(chat_id).reserve())
+                if delay:
+                    await asyncio.sleep(delay)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning("flood control method=%s chat_id=%s retry_after=%s attempt=%d",
+                               type(method).__name__, chat_id, e.retry_after, attempt + 1)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                else:
+                    await asyncio.sleep(e.retry_after)
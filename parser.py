@@ -1,26 +1,30 @@
+import hashlib
+import logging
 import re
-import json
 from datetime import datetime
 
+from catalog import get_catalog, normalize
+from matcher import ServiceMatcher
+from metrics import PARSED_CARS, UNKNOWN_FRAGMENTS, FUZZY_MATCHES
+
+logger = logging.getLogger(__name__)
+
 PLATE_REGEX = r"\b[А-ЯA-ZЁё]{1}[А-ЯA-ZЁё0-9]{2,9}\b"
+PART_SEPARATORS = re.compile(r'[,.;\n]|(?:\s+и\s+)|(?:\s+and\s+)|(?:\s*&\s*)')
 
 FIXED_COSTS = {
     # Пример: "полировка": 1000
 }
 
-def normalize(s):
-    return " ".join(s.strip().lower().split())
-
 def load_materials():
-    with open("materials.json", encoding="utf-8") as f:
-        materials_json = json.load(f)
-    elements = {normalize(k): v for k, v in materials_json.get("elements", {}).items()}
-    labor = {normalize(k): v for k, v in materials_json.get("labor", {}).items()}
-    price_per_m2 = materials_json.get("pricing", {}).get("area_cost_per_m2", 360)
-    return elements, labor, price_per_m2
-
-def parse_report_text(text: str):
-    elements, labor, price_per_m2 = load_materials()
+    return get_catalog().as_tuple()
+
+def parse_report_text(text: str, catalog=None, default_date=None):
+    # catalog можно передать явно, чтобы знать, по какой версии прайса посчитан отчет;
+    # default_date (ГГГГ-ММ-ДД) — дата сообщения при импорте истории
+    if catalog is None:
+        catalog = get_catalog()
+    elements, labor, price_per_m2 = catalog.as_tuple()
     lines = text.strip().splitlines()
 
     result = []
@@ -40,7 +44,7 @@ def parse_report_text(text: str):
         if date_match:
             day, month, year = date_match.groups()
             if not year:
-                year = str(datetime.now().year)
+                year = default_date[:4] if default_date else str(datetime.now().year)
             current_date = f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
             continue
 
@@ -50,7 +54,8 @@ def parse_report_text(text: str):
             # Сохраняем предыдущую запись
             if current_plate and current_description.strip():
                 result.append(
-                    process_entry(current_plate, current_description, elements, labor, price_per_m2, current_date)
+                    process_entry(current_plate, current_description, elements, labor, price_per_m2, current_date,
+                          matcher=catalog.matcher)
                 )
             # Обновляем текущую машину
             current_plate = plate_match.group(0).upper()
@@ -62,37 +67,59 @@ def parse_report_text(text: str):
     # Последняя запись
     if current_plate and current_description.strip():
         result.append(
-            process_entry(current_plate, current_description, elements, labor, price_per_m2, current_date)
+            process_entry(current_plate, current_description, elements, labor, price_per_m2, current_date,
+                          matcher=catalog.matcher)
         )
 
     # Если дата не была найдена, подставим сегодняшнюю
     if not current_date:
-        current_date = datetime.now().strftime("%Y-%m-%d")
+        current_date = default_date or datetime.now().strftime("%Y-%m-%d")
 
     return result, current_date
 
-def process_entry(plate, description, elements, labor, price_per_m2, date):
-    parts = [normalize(p) for p in re.split(r'[,.;\n]|(?:\s+и\s+)|(?:\s+and\s+)|(?:\s*&\s*)', description) if p.strip()]
-    print("DEBUG parts:", parts)
+def split_parts(description):
+    """Нормализованные услуги из описания машины."""
+    return [normalize(p) for p in PART_SEPARATORS.split(description) if p.strip()]
+
+def content_hash(user_id, report_date, plate, description):
+    """Отпечаток записи о машине: сотрудник, дата отчета, номер и услуги без учета порядка и регистра.
+
+    Дата — именно дата отчета (reports.date), а не дата строки машины: в БД
+    хранится только она, и по ней же миграция считает отпечатки старых машин.
+    Повторно присланный или пересланный отчет дает те же отпечатки.
+
+    Префикс "дата:сотрудник" держит отпечатки одного отчета рядом в индексе:
+    запись отчета меняет одну-две страницы индекса, а не по странице на машину.
+    """
+    key = "\x1f".join([(plate or "").upper(), *sorted(split_parts(description or ""))])
+    return f"{report_date}:{user_id}:{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+def process_entry(plate, description, elements, labor, price_per_m2, date, matcher=None):
+    if matcher is None:
+        matcher = ServiceMatcher(elements, labor)
+    parts = split_parts(description)
+    # Проверяем уровень один раз: при выключенном DEBUG строки не форматируются вовсе
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("parts plate=%s parts=%r", plate, parts)
 
     total_area = 0.0
     total_labor = 0
     unknown_parts = []
+    items = []
+    fuzzy_matches = 0
 
     for part_norm in parts:
-        labor_cost = labor.get(part_norm)
-        area_val = elements.get(part_norm)
-        print(f"DEBUG '{part_norm}': labor={labor_cost}, area={area_val}")
-        if labor_cost is None and area_val is None:
-            unknown_parts.append(part_norm)
-        total_labor += labor_cost or 0
-        total_area += area_val or 0
-
-    # Логирование нераспознанных услуг
-    if unknown_parts:
-        with open("unrecognized_services.txt", "a", encoding="utf-8") as f:
-            for unk in unknown_parts:
-                f.write(f"{date}, {plate}, {unk}\n")
+        matched, unknown, fuzzy = matcher.match(part_norm)
+        if debug:
+            logger.debug("match plate=%s part=%r matched=%r unknown=%r fuzzy=%d",
+                         plate, part_norm, matched, unknown, fuzzy)
+        for key, qty in matched:
+            total_labor += (labor.get(key) or 0) * qty
+            total_area += (elements.get(key) or 0) * qty
+        items.extend(matched)
+        unknown_parts.extend(unknown)
+        fuzzy_matches += fuzzy
 
     # Фиксированные услуги
     fixed_cost = 0
@@ -101,6 +128,10 @@ def process_entry(plate, description, elements, labor, price_per_m2, date):
         if key in desc_lower:
             fixed_cost += value
 
+    PARSED_CARS.inc()
+    UNKNOWN_FRAGMENTS.inc(len(unknown_parts))
+    FUZZY_MATCHES.inc(fuzzy_matches)
+
     material_cost = round(total_area * price_per_m2)
     total_cost = material_cost + fixed_cost
 
@@ -110,7 +141,10 @@ def process_entry(plate, description, elements, labor, price_per_m2, date):
         "area": round(total_area, 2),
         "cost": total_cost,
         "labor_cost": total_labor,
-        "date": date
+        "date": date,
+        "items": items,
+        "unknown": unknown_parts,
+        "fuzzy": fuzzy_matches
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+"""Отчет за период за один проход по машинам.
+
+Итоги и разбивки по сотрудникам и по дням копятся по ходу чтения
+детализации: строки идут кортежами прямо из курсора и не сохраняются,
+поэтому память не растет с числом машин. Текст отчета в боте и лист
+детализации Excel получают строки из одного и того же прохода.
+"""
+
+from db import iter_car_details
+
+
+class Subtotal:
+    """Машины, уникальные номера и суммы одной группы отчета."""
+
+    __slots__ = ("key", "cars", "plates", "area", "cost", "labor_cost")
+
+    def __init__(self, key):
+        self.key = key
+        self.cars = 0
+        self.plates = set()
+        self.area = 0.0
+        self.cost = 0.0
+        self.labor_cost = 0.0
+
+    def add(self, plate, area, cost, labor_cost):
+        self.cars += 1
+        if plate:
+            self.plates.add(plate)
+        self.area += area or 0
+        self.cost += cost or 0
+        self.labor_cost += labor_cost or 0
+
+    def as_row(self):
+        """(ключ, машин, уникальных номеров, площадь, материалы, работы) — как у get_daily_subtotals."""
+        return self.key, self.cars, len(self.plates), self.area, self.cost, self.labor_cost
+
+
+class PeriodReport:
+    """Проход по детализации за период с подсчетом итогов.
+
+    Итерация отдает строки CAR_DETAILS_SQL по дате; после нее заполнены
+    summary и разбивки. on_car(номер, строка) вызывается для каждой машины —
+    так вместе с листом Excel собирается текст отчета.
+    """
+
+    __slots__ = ("date_from", "date_to", "user_id", "on_car", "total", "employees", "days")
+
+    def __init__(self, date_from, date_to, user_id=None, on_car=None):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.user_id = user_id
+        self.on_car = on_car
+        self.total = Subtotal(None)
+        self.employees = {}  # user_id -> Subtotal с именем сотрудника в key
+        self.days = {}  # дата -> Subtotal
+
+    def __iter__(self):
+        for car in iter_car_details(self.date_from, self.date_to, self.user_id):
+            self.add(car)
+            if self.on_car is not None:
+                self.on_car(self.total.cars, car)
+            yield car
+
+    def add(self, car):
+        plate, _, area, cost, labor_cost, date, name, user_id = car
+        self.total.add(plate, area, cost, labor_cost)
+        employee = self.employees.get(user_id)
+        if employee is None:
+            employee = self.employees[user_id] = Subtotal(name)
+        employee.add(plate, area, cost, labor_cost)
+        day = self.days.get(date)
+        if day is None:
+            day = self.days[date] = Subtotal(date)
+        day.add(plate, area, cost, labor_cost)
+
+    @property
+    def summary(self):
+        """(уникальных номеров, площадь, материалы, работы) — как у get_report_summary."""
+        _, _, plates, area, cost, labor_cost = self.total.as_row()
+        return plates, area, cost, labor_cost
+
+    def employee_subtotals(self):
+        return sorted((s.as_row() for s in self.employees.values()), key=lambda row: row[0] or "")
+
+    def daily_subtotals(self):
+        # строки идут по дате, словарь сохраняет этот порядок
+        return [s.as_row() for s in self.days.values()]
+
+
+def build_report(date_from: str, date_to: str, user_id=None, on_car=None) -> PeriodReport:
+    """Итоги за период без листа Excel. Функция блокирующая."""
+    report = PeriodReport(date_from, date_to, user_id, on_car)
+    for _ in report:
+        pass
+    return report
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = "photo_cache"
+CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 ГБ на диске под скачанные фото
+EVICT_TARGET = 0.9  # после вытеснения остается не больше 90% бюджета
+PREFETCH = True  # скачивать фото в кэш сразу при получении
+
+
+class PhotoCache:
+    """Дисковый кэш фото из Telegram с LRU-вытеснением по бюджету в байтах.
+
+    Файлы пишутся через временный файл и os.replace, индекс (размер и время
+    последнего обращения) хранится в SQLite, поэтому кэш можно читать из
+    нескольких потоков и процессов одновременно.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    ext TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, "index.db"), timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _path(self, key, ext):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(digest[:2], f"{digest}.{ext}")
+
+    def get(self, key):
+        """Возвращает (содержимое, расширение) или None."""
+        conn = self._conn()
+        row = conn.execute("SELECT path, ext FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        path, ext = row
+        try:
+            with open(os.path.join(self.directory, path), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # файл успели вытеснить или удалить вручную
+            with conn:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        with conn:
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return data, ext
+
+    def put(self, key, data, ext):
+        path = self._path(key, ext)
+        full_path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_path = f"{full_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, path, ext, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, path, ext, len(data), time.time())
+            )
+        self.evict()
+
+    def evict(self):
+        conn = self._conn()
+        total = conn.execute("SELECT IFNULL(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICT_TARGET
+        removed = []
+        with conn:
+            for key, path, size in conn.execute(
+                "SELECT key, path, size FROM entries ORDER BY last_access"
+            ).fetchall():
+                if total <= target:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                removed.append(path)
+                total -= size
+        for path in removed:
+            try:
+                os.remove(os.path.join(self.directory, path))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        row = self._conn().execute("SELECT COUNT(*), IFNULL(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": row[0], "bytes": row[1], "max_bytes": self.max_bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_photo_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PhotoCache()
+    return _cache
@@ -0,0 +1,194 @@
+import asyncio
+import io
+import logging
+import tempfile
+import threading
+import time
+import zipfile
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import InputFile
+
+from db_async import run_io
+from metrics import EXPORT_SECONDS, EXPORT_BYTES
+from photo_cache import get_photo_cache
+
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024  # лимит Bot API на отправку файла
+PART_LIMIT = TELEGRAM_UPLOAD_LIMIT - 512 * 1024  # запас на заголовки multipart
+DOWNLOAD_CONCURRENCY = 8
+DOWNLOAD_RETRIES = 3
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # больше этого архив уходит из памяти на диск
+PROGRESS_INTERVAL = 2.0  # секунды между обновлениями прогресса
+
+# Уже сжатые форматы кладем в архив без повторного сжатия
+STORED_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "gif", "heic", "mp4", "mov"}
+
+logger = logging.getLogger(__name__)
+
+
+class SpooledInputFile(InputFile):
+    """Отправка архива из временного файла кусками, без чтения целиком в память."""
+
+    def __init__(self, file, filename, chunk_size=64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class ArchivePart:
+    def __init__(self, file, count):
+        self.file = file
+        self.count = count
+        self.size = file.tell()
+        self.input_file = None
+
+    def close(self):
+        self.file.close()
+
+
+class ZipPartWriter:
+    """Пишет записи в zip и начинает новую часть, если текущая превысит лимит.
+
+    Методы блокирующие (сжатие, запись на диск) — вызываются из потоков;
+    zipfile не потокобезопасен, поэтому записи идут по очереди под замком.
+    """
+
+    def __init__(self, part_limit=PART_LIMIT):
+        self.part_limit = part_limit
+        self.parts = []
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self.zip = zipfile.ZipFile(self.file, "w")
+        self.count = 0
+        self.directory_size = 22  # запись конца центрального каталога
+
+    def _close_part(self):
+        self.zip.close()
+        self.parts.append(ArchivePart(self.file, self.count))
+
+    def write(self, name, data):
+        with self._lock:
+            self._write(name, data)
+
+    def _write(self, name, data):
+        # локальный заголовок + запись центрального каталога на файл
+        overhead = 30 + 46 + 2 * len(name.encode("utf-8"))
+        if self.count and self.file.tell() + self.directory_size + len(data) + overhead > self.part_limit:
+            self._close_part()
+            self._open()
+        ext = name.rsplit(".", 1)[-1].lower()
+        compress = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        self.zip.writestr(name, data, compress_type=compress)
+        self.count += 1
+        self.directory_size += 46 + len(name.encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            if self.count or not self.parts:
+                self._close_part()
+            return self.parts
+
+    def discard(self):
+        # замок дожидается записи, которую поток еще не закончил
+        with self._lock:
+            self.zip.close()
+            self.file.close()
+            for part in self.parts:
+                part.close()
+
+
+async def download_photo(bot, file_id, retries=DOWNLOAD_RETRIES):
+    """Скачивает фото из Telegram; возвращает (содержимое, расширение)."""
+    error = None
+    for attempt in range(retries):
+        try:
+            file = await bot.get_file(file_id)
+            buffer = io.BytesIO()
+            await bot.download_file(file.file_path, destination=buffer)
+            ext = file.file_path.rsplit(".", 1)[-1] if "." in file.file_path else "jpg"
+            return buffer.getvalue(), ext
+        except TelegramRetryAfter as e:
+            error = e
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            error = e
+            if attempt < retries - 1:
+                await asyncio.sleep(2 ** attempt)
+    raise error
+
+
+async def fetch_photo(bot, file_id, cache=None):
+    """Фото из локального кэша, а при промахе — из Telegram с записью в кэш."""
+    cache = cache or get_photo_cache()
+    cached = await run_io(cache.get, file_id)
+    if cached is not None:
+        return cached
+    content, ext = await download_photo(bot, file_id)
+    await run_io(cache.put, file_id, content, ext)
+    return content, ext
+
+
+async def prefetch_photo(bot, file_id):
+    try:
+        await fetch_photo(bot, file_id)
+    except Exception as e:
+        logger.warning("prefetch failed file_id=%s error=%s", file_id, e)
+
+
+async def build_photo_archives(bot, file_ids, basename, progress=None,
+                               concurrency=DOWNLOAD_CONCURRENCY, part_limit=PART_LIMIT):
+    """Скачивает фото параллельно и раскладывает их по zip-архивам.
+
+    progress — необязательная корутина progress(done, total). Возвращает
+    список ArchivePart с готовым input_file для отправки.
+    """
+    started = time.perf_counter()
+    writer = ZipPartWriter(part_limit)
+    semaphore = asyncio.Semaphore(concurrency)
+    total = len(file_ids)
+    done = 0
+    last_report = time.monotonic()
+
+    async def fetch(i, file_id):
+        nonlocal done, last_report
+        async with semaphore:
+            try:
+                content, ext = await fetch_photo(bot, file_id)
+                # Сжатие и запись на диск (до 50 МБ на часть) — не в event loop
+                await run_io(writer.write, f"photo_{i:03d}.{ext}", content)
+            except Exception as e:
+                # Если фото не скачалось, кладем в архив текстовый файл с причиной
+                await run_io(
+                    writer.write,
+                    f"photo_{i:03d}_{file_id}.txt",
+                    f"Фото с ID: {file_id}\nОшибка при загрузке: {e}".encode("utf-8")
+                )
+        done += 1
+        now = time.monotonic()
+        if progress and (done == total or now - last_report >= PROGRESS_INTERVAL):
+            last_report = now
+            await progress(done, total)
+
+    try:
+        await asyncio.gather(*(fetch(i, file_id) for i, file_id in enumerate(file_ids, 1)))
+    except BaseException:
+        writer.discard()
+        raise
+
+    parts = await run_io(writer.close)
+    for n, part in enumerate(parts, 1):
+        filename = f"{basename}.zip" if len(parts) == 1 else f"{basename}_part{n}.zip"
+        part.input_file = SpooledInputFile(part.file, filename)
+    EXPORT_SECONDS.observe(time.perf_counter() - started, "photos")
+    EXPORT_BYTES.observe(sum(part.size for part in parts), "photos")
+    return parts
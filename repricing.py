@@ -0,0 +1,55 @@
+"""Пересчет площади и стоимости машин за период по текущему прайсу.
+
+    python repricing.py 2025-01-01 2025-12-31
+
+Итоги пересчитываются в SQL из позиций car_items. Перед этим заново
+разбираются описания машин с нераспознанными фрагментами (после /add_alias
+они могут найтись в прайсе) и машин, записанных до появления позиций.
+"""
+import argparse
+
+from catalog import get_catalog
+from db import get_cars_to_reparse, replace_car_items, reprice_cars
+from parser import process_entry
+
+BACKFILL_BATCH = 500
+
+
+def backfill_items(date_from, date_to, catalog, batch_size=BACKFILL_BATCH):
+    """Заново разбирает описания машин из get_cars_to_reparse; возвращает число обработанных машин."""
+    elements, labor, price_per_m2 = catalog.as_tuple()
+    after_id = 0
+    total = 0
+    while True:
+        rows = get_cars_to_reparse(date_from, date_to, after_id, batch_size)
+        if not rows:
+            return total
+        cars = [
+            (car_id, process_entry(plate or "", description or "", elements, labor, price_per_m2, date,
+                                   matcher=catalog.matcher))
+            for car_id, plate, description, date in rows
+        ]
+        replace_car_items(cars, catalog.version)
+        after_id = rows[-1][0]
+        total += len(rows)
+
+
+def reprice(date_from, date_to, catalog=None):
+    """Возвращает (машин с заново разобранными описаниями, позиций пересчитано, машин изменено)."""
+    catalog = catalog or get_catalog()
+    backfilled = backfill_items(date_from, date_to, catalog)
+    items, cars = reprice_cars(date_from, date_to, catalog.version)
+    return backfilled, items, cars
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Пересчет отчетов за период по текущему materials.json")
+    arg_parser.add_argument("date_from", help="ГГГГ-ММ-ДД")
+    arg_parser.add_argument("date_to", help="ГГГГ-ММ-ДД включительно")
+    args = arg_parser.parse_args()
+
+    from db import init_db
+    init_db()
+    backfilled, items, cars = reprice(args.date_from, args.date_to)
+    print(f"✅ Описания разобраны заново у {backfilled} машин, пересчитано позиций: {items}, "
+          f"изменились итоги у {cars} машин")
@@ -0,0 +1,26 @@
+import json
+
+import catalog
+from parser import process_entry
+
+
+def test_alias_to_key_with_quantity_is_priced_per_unit(tmp_path, monkeypatch):
+    # add_alias перечитывает прайс и подменяет текущий снимок — вернем прежний
+    monkeypatch.setattr(catalog, "_current", None)
+    path = tmp_path / "materials.json"
+    path.write_text(json.dumps({
+        "elements": {"8 элементов": 8.0},
+        "labor": {"8 элементов": 12000},
+        "pricing": {"area_cost_per_m2": 360},
+    }, ensure_ascii=False), encoding="utf-8")
+
+    # Подсказка /unknown для "10 элементов" — ключ "8 элементов"
+    updated = catalog.add_alias("10 элементов", "8 элементов", str(path))
+
+    assert updated.elements["элементов"] == 1
+    assert updated.labor["элементов"] == 1500
+    car = process_entry("А001АА", "10 элементов", *updated.as_tuple(), "2025-01-01", matcher=updated.matcher)
+    assert car["items"] == [("элементов", 10)]
+    assert car["unknown"] == []
+    assert car["area"] == 10.0
+    assert car["labor_cost"] == 15000
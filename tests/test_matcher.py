@@ -0,0 +1,29 @@
+import pytest
+
+from matcher import ServiceMatcher
+
+ELEMENTS = {"капот": 1.8, "бампер": 2.6, "крыша": 3.5, "багажник": 1.2, "2 двери": 4.0}
+LABOR = {"капот": 1500, "бампер": 1500, "крыша": 2500, "багажник": 1200, "2 двери": 3000}
+
+
+@pytest.fixture
+def matcher():
+    return ServiceMatcher(ELEMENTS, LABOR)
+
+
+@pytest.mark.parametrize("fragment", ["половина капота", "кай бампер", "крышка багажника"])
+def test_fragment_with_leftover_words_stays_unknown(matcher, fragment):
+    assert matcher.match(fragment) == ([], [fragment], 0)
+
+
+def test_trailing_number_is_quantity(matcher):
+    assert matcher.match("бампер 2") == ([("бампер", 2)], [], 0)
+    assert matcher.match("2 бампера") == ([("бампер", 2)], [], 0)
+
+
+def test_typo_in_long_word_is_matched(matcher):
+    assert matcher.match("багажнек") == ([("багажник", 1)], [], 1)
+
+
+def test_suggest_offers_keys_inside_unknown_fragment(matcher):
+    assert matcher.suggest("половина капота")[0] == "капот"
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime
+
+from db import get_connection, record_unknown_services
+from db_async import run_db
+
+FLUSH_INTERVAL = 10  # секунд между записями накопленных фрагментов в БД
+LEGACY_LOG = "unrecognized_services.txt"
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownServiceRecorder:
+    """Копит нераспознанные фрагменты в памяти и пишет их в БД пачками."""
+
+    def __init__(self):
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def record(self, cars, user_id):
+        today = datetime.now().strftime("%Y-%m-%d")
+        rows = [(fragment, car["plate"], user_id, car.get("date") or today)
+                for car in cars for fragment in car.get("unknown", ())]
+        if rows:
+            with self._lock:
+                self._rows.extend(rows)
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+        record_unknown_services(rows)
+        return len(rows)
+
+
+recorder = UnknownServiceRecorder()
+
+
+async def flush_periodically(interval=FLUSH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_db(recorder.flush)
+        except Exception:
+            logger.exception("unknown services flush failed")
+
+
+def import_legacy_log(path=LEGACY_LOG):
+    """Переносит строки "дата, номер, фрагмент" из старого текстового лога в БД.
+
+    Выполняется только пока таблица пуста, чтобы не задвоить счетчики.
+    """
+    if not os.path.exists(path):
+        return 0
+    if get_connection().execute("SELECT 1 FROM unknown_services LIMIT 1").fetchone():
+        return 0
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = [p.strip() for p in line.rstrip("\n").split(",", 2)]
+            if len(parts) != 3 or not parts[2]:
+                continue
+            date, plate, fragment = parts
+            rows.append((fragment, plate, 0, None if date == "None" else date))
+    record_unknown_services(rows)
+    return len(rows)
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+
+from db_async import resolve_user
+
+USER_CACHE_TTL = 300  # секунд; ограничивает устаревание при нескольких воркерах
+USER_CACHE_SIZE = 1024
+
+
+class UserContext:
+    __slots__ = ("id", "tg_id", "name", "is_admin")
+
+    def __init__(self, id, tg_id, name, is_admin):
+        self.id = id
+        self.tg_id = tg_id
+        self.name = name
+        self.is_admin = is_admin
+
+
+class UserCache:
+    """LRU-кэш tg_id -> UserContext с ограниченным временем жизни записи."""
+
+    def __init__(self, ttl=USER_CACHE_TTL, maxsize=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, tg_id):
+        item = self._items.get(tg_id)
+        if item is None:
+            return None
+        user, expires = item
+        if expires < time.monotonic():
+            del self._items[tg_id]
+            return None
+        self._items.move_to_end(tg_id)
+        return user
+
+    def put(self, user):
+        self._items[user.tg_id] = (user, time.monotonic() + self.ttl)
+        self._items.move_to_end(user.tg_id)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def invalidate(self, tg_id):
+        self._items.pop(tg_id, None)
+
+
+user_cache = UserCache()
+
+
+async def get_user_context(tg_id, name):
+    user = user_cache.get(tg_id)
+    if user is None or user.name != name:
+        # новый пользователь, истекшая запись или смена имени в Telegram
+        uid, db_name, admin = await resolve_user(tg_id, name)
+        user = UserContext(uid, tg_id, db_name, admin)
+        user_cache.put(user)
+    return user
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Один раз на апдейт определяет отправителя и передает его в хендлеры как `user`."""
+
+    async def __call__(self, handler, event, data):
+        from_user = data.get("event_from_user")
+        if from_user is not None:
+            data["user"] = await get_user_context(from_user.id, from_user.full_name)
+        return await handler(event, data)
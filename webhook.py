@@ -0,0 +1,190 @@
+"""Прием апдейтов через webhook (aiohttp) вместо long polling.
+
+    python bot.py --webhook                                  # боевой режим
+    python webhook.py replay updates.jsonl                   # отправить записанные апдейты на локальный webhook
+
+Настройки берутся из config.py (все необязательные):
+WEBHOOK_URL — публичный адрес, если задан, бот сам вызывает setWebhook;
+WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH — где слушать; WEBHOOK_SECRET —
+значение заголовка X-Telegram-Bot-Api-Secret-Token.
+
+Запрос подтверждается ответом 200 сразу после постановки апдейта в очередь,
+обработку ведет ограниченный пул задач. update_id записывается в БД после
+успешной обработки, поэтому повторно доставленный апдейт не обрабатывается
+второй раз даже после перезапуска или на другом экземпляре бота, а апдейт,
+обработка которого упала или не успела до остановки, можно прогнать заново
+(replay из файла --record).
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from aiohttp import web
+from aiogram.types import Update
+
+import config
+from db_async import is_update_processed, mark_update_processed, prune_processed_updates
+from metrics import WEBHOOK_UPDATES
+
+WEBHOOK_URL = getattr(config, "WEBHOOK_URL", None)
+WEBHOOK_HOST = getattr(config, "WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8080)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", None)
+WEBHOOK_WORKERS = 16  # апдейтов, обрабатываемых одновременно
+WEBHOOK_QUEUE_SIZE = 1000  # при переполнении отвечаем 503, Telegram повторит доставку
+DRAIN_TIMEOUT = 30  # секунд на обработку очереди при остановке
+PRUNE_INTERVAL = 3600
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    def __init__(self, dp, bot, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                 workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, record=None):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.queue = asyncio.Queue(queue_size)
+        self.record = record  # файл JSONL, куда дописываются принятые апдейты
+        self.closing = False
+        self._pending = set()  # update_id в очереди и в обработке этого процесса
+        self._tasks = []
+        self._runner = None
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request):
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            WEBHOOK_UPDATES.inc(1, "forbidden")
+            return web.Response(status=403)
+        if self.closing or self.queue.full():
+            # Апдейт еще не отмечен принятым — Telegram доставит его повторно
+            WEBHOOK_UPDATES.inc(1, "overloaded")
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+            update = Update.model_validate(data, context={"bot": self.bot})
+        except ValueError as e:
+            WEBHOOK_UPDATES.inc(1, "invalid")
+            return web.Response(status=400, text=str(e)[:200])
+        # Проверка в БД ждет поток, поэтому множество в памяти смотрим уже после нее
+        if await is_update_processed(update.update_id) or update.update_id in self._pending:
+            WEBHOOK_UPDATES.inc(1, "duplicate")
+            return web.Response()
+        self._pending.add(update.update_id)
+        if self.record:
+            with open(self.record, "a", encoding="utf-8") as f:
+                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        await self.queue.put(update)
+        WEBHOOK_UPDATES.inc(1, "accepted")
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                await mark_update_processed(update.update_id)
+            except Exception:
+                logger.exception("update failed update_id=%s", update.update_id)
+            finally:
+                self._pending.discard(update.update_id)
+                self.queue.task_done()
+
+    async def _prune(self):
+        while True:
+            try:
+                await prune_processed_updates()
+            except Exception:
+                logger.exception("processed updates prune failed")
+            await asyncio.sleep(PRUNE_INTERVAL)
+
+    async def start(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._prune()))
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info("webhook listening host=%s port=%s path=%s", host, port, self.path)
+
+    async def stop(self, timeout=DRAIN_TIMEOUT):
+        """Перестает принимать апдейты, дорабатывает очередь и останавливает пул."""
+        self.closing = True
+        if self._runner:
+            await self._runner.cleanup()
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("webhook drain timeout pending=%d", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def run_webhook(dp, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, record=None):
+    """Работает до SIGINT/SIGTERM, затем корректно останавливается."""
+    server = WebhookServer(dp, bot, record=record)
+    await server.start(host, port)
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: остановка по KeyboardInterrupt
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+
+
+def _read_updates(path):
+    with open(path, encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+async def replay(path, url, secret=None):
+    """POST записанных апдейтов на webhook; возвращает {HTTP-статус: количество}."""
+    from aiohttp import ClientSession
+
+    headers = {SECRET_HEADER: secret} if secret else {}
+    statuses = {}
+    async with ClientSession() as session:
+        for update in _read_updates(path):
+            async with session.post(url, json=update, headers=headers) as response:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+    return statuses
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Инструменты webhook-режима")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="отправить записанные апдейты на webhook")
+    replay_parser.add_argument("path", help="JSONL или JSON-массив апдейтов")
+    replay_parser.add_argument("--url", default=f"http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    replay_parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    args = arg_parser.parse_args()
+
+    statuses = asyncio.run(replay(args.path, args.url, args.secret))
+    print(", ".join(f"HTTP {status}: {count}" for status, count in sorted(statuses.items())))